@@ -0,0 +1,283 @@
+from database import SessionLocal, engine
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, Index, and_, inspect, insert, or_, select
+from sqlalchemy.exc import ProgrammingError, OperationalError
+from dotenv import load_dotenv
+from collections import deque, defaultdict
+from datetime import datetime, timezone
+import atexit
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+import metrics
+
+# Buffered audit log writer.
+#
+# Mutations enqueue entries with record(), which only appends to an in-memory
+# deque. A background thread inserts the buffer in batches whenever it reaches
+# AUDIT_FLUSH_SIZE entries or AUDIT_FLUSH_INTERVAL seconds have passed, so the
+# write path never pays for an extra commit. The buffer is capped at
+# AUDIT_MAX_BUFFER entries (oldest dropped first) and is flushed on shutdown, so
+# at most one flush interval of entries can be lost if the process is killed.
+#
+# Entries are stored in one table per calendar month (audit_logs_YYYYMM) with the
+# same columns as models.AuditLog. Queries walk the months newest first with a
+# keyset cursor on (timestamp, id), which is unique because a timestamp always
+# maps to exactly one month table. Retention is enforced by dropping whole
+# month tables, which is cheap on both SQLite and Postgres compared to
+# row-level DELETEs.
+
+load_dotenv()
+
+AUDIT_FLUSH_SIZE = int(os.getenv("AUDIT_FLUSH_SIZE", 100))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))  # seconds
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", 10000))
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", 12))  # 0 keeps everything
+
+PARTITION_PREFIX = "audit_logs_"
+PARTITION_PATTERN = re.compile(r"^audit_logs_(\d{6})$")
+PARTITION_REFRESH_INTERVAL = 60  # seconds
+RETENTION_CHECK_INTERVAL = 3600  # seconds
+
+def month_key(timestamp: datetime) -> str:
+    return f"{timestamp.year:04d}{timestamp.month:02d}"
+
+def _shift_month(key: str, months: int) -> str:
+    index = int(key[:4]) * 12 + int(key[4:]) - 1 + months
+    return f"{index // 12:04d}{index % 12 + 1:02d}"
+
+class AuditPartitions:
+    def __init__(self, engine):
+        self.engine = engine
+        self.metadata = MetaData()
+        self._lock = threading.Lock()
+        self._existing = set()
+        self._refreshed_at = 0.0
+
+    def table(self, key: str) -> Table:
+        name = PARTITION_PREFIX + key
+        with self._lock:
+            if name in self.metadata.tables:
+                return self.metadata.tables[name]
+            return Table(
+                name, self.metadata,
+                Column("id", Integer, primary_key=True),
+                Column("action", String),
+                Column("timestamp", DateTime),
+                Column("moderator_name", String),
+                Column("details", String),
+                Index(f"ix_{name}_timestamp_id", "timestamp", "id"),
+                Index(f"ix_{name}_moderator_name", "moderator_name"),
+                Index(f"ix_{name}_action", "action")
+            )
+
+    def existing(self, newest_needed: str | None = None) -> list[str]:
+        # Other workers create partitions too, so the cached list is refreshed
+        # periodically and whenever a query reaches past the newest known month
+        stale = time.monotonic() - self._refreshed_at > PARTITION_REFRESH_INTERVAL
+        newest_known = max(self._existing) if self._existing else None
+        if stale or (newest_needed and (newest_known is None or newest_needed > newest_known)):
+            metrics.record_cache("audit_partitions", False)
+            names = inspect(self.engine).get_table_names()
+            keys = {match.group(1) for match in map(PARTITION_PATTERN.match, names) if match}
+            with self._lock:
+                self._existing = keys
+                self._refreshed_at = time.monotonic()
+        else:
+            metrics.record_cache("audit_partitions", True)
+        return sorted(self._existing, reverse=True)
+
+    def ensure(self, key: str) -> Table:
+        table = self.table(key)
+        if key not in self._existing:
+            try:
+                table.create(self.engine, checkfirst=True)
+            except (ProgrammingError, OperationalError):
+                # Another worker created it between the check and the CREATE
+                if not inspect(self.engine).has_table(table.name):
+                    raise
+            with self._lock:
+                self._existing.add(key)
+        return table
+
+    def drop_expired(self, retention_months: int, now: datetime | None = None) -> list[str]:
+        if retention_months <= 0:
+            return []
+        cutoff = _shift_month(month_key(now or datetime.utcnow()), -retention_months)
+        dropped = []
+        for key in self.existing():
+            if key < cutoff:
+                self.table(key).drop(self.engine, checkfirst=True)
+                dropped.append(key)
+        if dropped:
+            with self._lock:
+                self._existing.difference_update(dropped)
+            logging.info(f"Dropped expired audit log partitions: {', '.join(dropped)}")
+        return dropped
+
+partitions = AuditPartitions(engine)
+
+class AuditWriter:
+    def __init__(self, session_factory, flush_size: int, flush_interval: float, max_buffer: int):
+        self.session_factory = session_factory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def record(self, action: str, moderator_name: str | None = None, target: str | None = None, before: dict | None = None, after: dict | None = None):
+        entry = {
+            "action": action,
+            "timestamp": datetime.utcnow(),
+            "moderator_name": moderator_name or "system",
+            "details": json.dumps({"target": target, "before": before, "after": after}, default=str)
+        }
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(entry)
+            pending = len(self._buffer)
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+        if self._stopped:
+            # Late entries during shutdown are written straight away
+            self.flush()
+        elif pending >= self.flush_size:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch = list(self._buffer)
+                self._buffer.clear()
+
+            by_month = defaultdict(list)
+            for entry in batch:
+                by_month[month_key(entry["timestamp"])].append(entry)
+
+            db = self.session_factory()
+            try:
+                # Create missing month tables before the session takes its write lock
+                tables = {key: partitions.ensure(key) for key in by_month}
+                for key, entries in by_month.items():
+                    db.execute(insert(tables[key]), entries)
+                db.commit()
+                return len(batch)
+            except Exception as e:
+                db.rollback()
+                logging.error(f"Error writing {len(batch)} audit log entries: {e}")
+                # Put the batch back for the next attempt without exceeding the cap
+                with self._lock:
+                    self._buffer.extendleft(reversed(batch))
+                    while len(self._buffer) > self.max_buffer:
+                        self._buffer.popleft()
+                        self.dropped += 1
+                return 0
+            finally:
+                db.close()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.flush()
+        if self.dropped:
+            logging.warning(f"{self.dropped} audit log entries were dropped because the buffer was full")
+
+    def _run(self):
+        retention_checked_at = 0.0
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - retention_checked_at > RETENTION_CHECK_INTERVAL:
+                retention_checked_at = time.monotonic()
+                try:
+                    partitions.drop_expired(AUDIT_RETENTION_MONTHS)
+                except Exception as e:
+                    logging.error(f"Error dropping expired audit log partitions: {e}")
+
+writer = AuditWriter(SessionLocal, AUDIT_FLUSH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_MAX_BUFFER)
+
+metrics.Gauge("audit_buffer_pending", "Audit log entries waiting to be written.", lambda: {(): writer.pending()})
+metrics.Gauge("audit_entries_dropped", "Audit log entries dropped because the buffer was full.", lambda: {(): writer.dropped})
+
+def record(action: str, moderator_name: str | None = None, target: str | None = None, before: dict | None = None, after: dict | None = None):
+    writer.record(action, moderator_name, target, before, after)
+
+def encode_cursor(timestamp: datetime, entry_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{entry_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    # Raises ValueError for anything that is not a cursor we handed out
+    timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(entry_id)
+
+def naive_utc(value: datetime | None) -> datetime | None:
+    # Timestamps are stored as naive UTC; aware query bounds are converted to match
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def query(db, start: datetime | None = None, end: datetime | None = None, moderator_name: str | None = None,
+          action: str | None = None, limit: int = 100, cursor: str | None = None) -> dict:
+    start, end = naive_utc(start), naive_utc(end)
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        after = (naive_utc(after[0]), after[1])
+    upper = end
+    if after:
+        upper = min(upper, after[0]) if upper else after[0]
+    newest = month_key(upper) if upper else None
+    oldest = month_key(start) if start else None
+
+    items = []
+    for key in partitions.existing(newest_needed=newest or month_key(datetime.utcnow())):
+        if newest and key > newest:
+            continue
+        if oldest and key < oldest:
+            break
+
+        table = partitions.table(key)
+        conditions = []
+        if start:
+            conditions.append(table.c.timestamp >= start)
+        if end:
+            conditions.append(table.c.timestamp < end)
+        if moderator_name:
+            conditions.append(table.c.moderator_name == moderator_name)
+        if action:
+            conditions.append(table.c.action == action)
+        if after:
+            conditions.append(or_(table.c.timestamp < after[0], and_(table.c.timestamp == after[0], table.c.id < after[1])))
+
+        # One extra row tells us whether there is another page
+        stmt = select(table).where(*conditions).order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit + 1 - len(items))
+        items.extend(dict(row._mapping) for row in db.execute(stmt))
+        if len(items) > limit:
+            break
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["timestamp"], items[-1]["id"])
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+from collections import defaultdict
+from time import perf_counter
+from benchmarks.run import BENCH_API_KEY, configure_environment, load_app, summarize, print_results, compare, replay
+
+# Replays traffic recorded by capture.CaptureMiddleware through the ASGI app
+# from main.py in-process.
+#
+#   python -m benchmarks.replay captures/ --database-url sqlite:///./benchmark.db --speed 1
+#   python -m benchmarks.replay captures/capture-20240101-120000-4242.jsonl --speed 10
+#   python -m benchmarks.replay captures/ --speed max --concurrency 8 --baseline replay-baseline.json
+#
+# --speed N keeps the recorded spacing between requests divided by N; with
+# --speed max the requests are sent back to back by --concurrency workers.
+# Captured values are pseudonyms, so lookups mostly miss against a real
+# database; replaying against a database seeded by benchmarks.seed reproduces
+# the request mix, the key distribution and the load pattern of production.
+# Requests that had a body are skipped unless the capture was made with
+# CAPTURE_BODIES=True.
+
+def capture_files(paths: list[str]) -> list[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "capture-*.jsonl")))
+        else:
+            files.append(path)
+    return files
+
+def load(paths: list[str]) -> tuple[list, int]:
+    entries = []
+    skipped = 0
+    for path in capture_files(paths):
+        with open(path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["body_size"] and "body" not in entry:
+                    skipped += 1
+                    continue
+                entries.append(entry)
+    # Files of several workers interleave, so order by the recorded time
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries, skipped
+
+def as_request(entry: dict):
+    # Same labels as benchmarks.run, so results can be compared with each other
+    label = f"{entry['method']} {entry['route'] or 'unmatched'}"
+    return label, entry["method"], entry["path"], entry["query"] or None, entry.get("body")
+
+async def replay_timed(client, entries: list, speed: float, concurrency: int) -> tuple[dict, float]:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    headers = {"x-api-key": BENCH_API_KEY}
+    slots = asyncio.Semaphore(concurrency)
+    lag = 0.0
+
+    async def send(label, method, path, params, body):
+        async with slots:
+            started = perf_counter()
+            response = await client.request(method, path, params=params, json=body, headers=headers)
+            latencies[label].append(perf_counter() - started)
+            if response.status_code >= 400:
+                errors[label] += 1
+
+    tasks = []
+    first = entries[0]["ts"]
+    started = perf_counter()
+    for entry in entries:
+        due = started + (entry["ts"] - first) / speed
+        delay = due - perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            lag = max(lag, -delay)
+        tasks.append(asyncio.create_task(send(*as_request(entry))))
+    await asyncio.gather(*tasks)
+    return summarize(latencies, errors, perf_counter() - started), lag
+
+async def run(args, entries: list) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=load_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+        if args.speed == "max":
+            return await replay(client, (as_request(entry) for entry in entries), args.concurrency)
+
+        results, lag = await replay_timed(client, entries, float(args.speed), args.concurrency)
+        if lag > 1:
+            print(f"Replay fell up to {lag:.1f}s behind schedule; the app could not keep up with --speed {args.speed}", file=sys.stderr)
+        return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the Azzamo Banlist API")
+    parser.add_argument("captures", nargs="+", help="capture files or directories containing capture-*.jsonl")
+    parser.add_argument("--database-url", default="sqlite:///./benchmark.db")
+    parser.add_argument("--speed", default="1", help="multiple of the recorded rate, or 'max'")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum in-flight requests; keep below the connection pool size (15 by default)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against a stored results file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    if args.speed != "max" and float(args.speed) <= 0:
+        parser.error("--speed must be positive or 'max'")
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    entries, skipped = load(args.captures)
+    if skipped:
+        print(f"Skipping {skipped} requests with a body that was not captured", file=sys.stderr)
+    if not entries:
+        print("No replayable requests found", file=sys.stderr)
+        return 1
+
+    configure_environment(args.database_url)
+    duration = entries[-1]["ts"] - entries[0]["ts"]
+    print(f"Replaying {len(entries)} requests spanning {duration:.1f}s at speed {args.speed}...", file=sys.stderr)
+    results = {"replay": asyncio.run(run(args, entries))}
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"captures": args.captures, "speed": args.speed, "requests": len(entries), "skipped": skipped}, "results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import hashlib
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, text
+
+# Deterministic benchmark data.
+#
+# Every entity is derived from its index, so the workloads can pick banned or
+# unknown keys without reading the database back. npub is stored as the hex
+# key (as approve_report does) because bech32-encoding a million keys would
+# dominate the seeding time.
+
+FULL_SCALE = {
+    "pubkeys": 1_000_000,
+    "words": 100_000,
+    "ips": 100_000,
+    "reports": 1_000_000,
+    "temp_bans": 10_000,
+}
+
+CHUNK_SIZE = 10_000
+
+def pubkey(index: int) -> str:
+    return hashlib.sha256(f"bench-pubkey-{index}".encode()).hexdigest()
+
+def unknown_pubkey(index: int) -> str:
+    return hashlib.sha256(f"bench-unknown-{index}".encode()).hexdigest()
+
+def word(index: int) -> str:
+    return f"benchword{index}"
+
+def ip(index: int) -> str:
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+def volumes(scale: float) -> dict:
+    return {name: max(1, int(count * scale)) for name, count in FULL_SCALE.items()}
+
+def _insert_chunks(conn, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+def seed(database_url: str, scale: float = 1.0, seed_value: int = 42) -> dict:
+    import models
+
+    counts = volumes(scale)
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    connect_args = {"check_same_thread": False} if "sqlite" in database_url else {}
+    engine = create_engine(database_url, connect_args=connect_args)
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("PRAGMA synchronous=OFF"))
+
+        _insert_chunks(conn, models.PublicKey.__table__, (
+            {"pubkey": pubkey(i), "npub": pubkey(i), "timestamp": now - timedelta(minutes=rng.randrange(60 * 24 * 365)), "ban_reason": rng.choice([None, "Spam", "Impersonation", "Abuse"])}
+            for i in range(counts["pubkeys"])
+        ))
+        _insert_chunks(conn, models.Word.__table__, (
+            {"word": word(i), "timestamp": now} for i in range(counts["words"])
+        ))
+        _insert_chunks(conn, models.IPAddress.__table__, (
+            {"ip": ip(i), "timestamp": now, "ban_reason": "Spam"} for i in range(counts["ips"])
+        ))
+        _insert_chunks(conn, models.TempBan.__table__, (
+            {"pubkey": pubkey(i), "expiry_timestamp": now + timedelta(hours=rng.randrange(-48, 168))} for i in range(counts["temp_bans"])
+        ))
+        # Reports cluster on a small set of heavily reported keys, like real spam waves
+        hot_keys = max(1, counts["reports"] // 100)
+        _insert_chunks(conn, models.UserReport.__table__, (
+            {
+                "pubkey": unknown_pubkey(int(rng.paretovariate(1.2)) % hot_keys),
+                "report_reason": "Spam",
+                "timestamp": now - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+                "status": rng.choice(["Pending", "Pending", "Pending", "Handled"]),
+                "reported_by": f"reporter{rng.randrange(50_000)}"
+            }
+            for _ in range(counts["reports"])
+        ))
+
+    engine.dispose()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
@@ -0,0 +1,63 @@
+import random
+from benchmarks.seed import pubkey, unknown_pubkey, word
+
+# Workloads are weighted mixes of request builders. Each builder returns
+# (label, method, path, params, json) where label names the endpoint in the
+# results; builders receive the seeded volumes and a seeded Random.
+
+def status_check(counts, rng):
+    # Relays mostly ask about authors that are not banned
+    if rng.random() < 0.05:
+        key = pubkey(rng.randrange(counts["pubkeys"]))
+    else:
+        key = unknown_pubkey(rng.randrange(10 * counts["pubkeys"]))
+    return "GET /blocked/pubkeys/status", "GET", "/blocked/pubkeys/status", {"pubkey": key}, None
+
+def poll_public_pubkeys(counts, rng):
+    return "GET /public/blocked/pubkeys", "GET", "/public/blocked/pubkeys", None, None
+
+def poll_public_words(counts, rng):
+    return "GET /public/blocked/words", "GET", "/public/blocked/words", None, None
+
+def poll_blocked_words(counts, rng):
+    return "GET /blocked/words", "GET", "/blocked/words", None, None
+
+def poll_stats(counts, rng):
+    return "GET /stats", "GET", "/stats", None, None
+
+def bulk_import_words(counts, rng):
+    start = counts["words"] + rng.randrange(10_000_000)
+    return "POST /bulk/blocked", "POST", "/bulk/blocked", {"entity_type": "word"}, [word(start + i) for i in range(100)]
+
+def report(counts, rng):
+    # A flood concentrates on a handful of keys from many reporters
+    key = unknown_pubkey(rng.randrange(20))
+    body = {"pubkey": key, "report_reason": "Spam", "reported_by": f"flood-reporter{rng.randrange(1_000_000)}"}
+    return "POST /reports", "POST", "/reports", None, body
+
+def reports_for_pubkey(counts, rng):
+    return "GET /reports/{pubkey}", "GET", f"/reports/{unknown_pubkey(rng.randrange(20))}", None, None
+
+WORKLOADS = {
+    "status": [(status_check, 1.0)],
+    "list-polling": [(poll_public_pubkeys, 0.2), (poll_public_words, 0.4), (poll_blocked_words, 0.2), (poll_stats, 0.2)],
+    "bulk-import": [(bulk_import_words, 1.0)],
+    "report-flood": [(report, 0.8), (reports_for_pubkey, 0.2)],
+    "mixed": [(status_check, 0.90), (report, 0.05), (reports_for_pubkey, 0.03), (poll_public_words, 0.01), (poll_stats, 0.01)],
+}
+
+# Full-list endpoints return every row, so they get far fewer requests
+REQUEST_SHARE = {
+    "status": 1.0,
+    "list-polling": 0.01,
+    "bulk-import": 0.05,
+    "report-flood": 0.5,
+    "mixed": 1.0,
+}
+
+def requests_for(workload: str, counts: dict, total: int, seed_value: int):
+    rng = random.Random(f"{workload}-{seed_value}")
+    builders, weights = zip(*WORKLOADS[workload])
+    for _ in range(max(1, int(total * REQUEST_SHARE[workload]))):
+        builder = rng.choices(builders, weights)[0]
+        yield builder(counts, rng)
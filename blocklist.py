@@ -0,0 +1,145 @@
+from database import SessionLocal
+from dotenv import load_dotenv
+import changes
+import crud
+import hashlib
+import os
+import re
+import struct
+import threading
+import time
+
+# Compact binary export of the blocked pubkeys for relays.
+#
+# Layout (all integers little-endian):
+#
+#   offset  size  field
+#   0       4     magic b"AZBL"
+#   4       2     format version (1)
+#   6       2     key size in bytes (32)
+#   8       8     number of keys
+#   16      8     generation time, unix seconds
+#   24      n*32  raw keys, sorted ascending and unique
+#
+# The keys start 8-byte aligned, so a relay can mmap the file and binary
+# search it in place without parsing anything (see contains()).
+#
+# The export is served from /public/blocked/pubkeys when the client asks for
+# MEDIA_TYPE or application/octet-stream. It is rebuilt on the next request
+# after a change to the pubkeys list is published, by this worker or another
+# one through the change feed in changes.py, and at least every
+# BLOCKLIST_MAX_AGE seconds in case a broadcast was lost.
+
+load_dotenv()
+
+BLOCKLIST_MAX_AGE = float(os.getenv("BLOCKLIST_MAX_AGE", 60))  # seconds
+
+MAGIC = b"AZBL"
+FORMAT_VERSION = 1
+KEY_SIZE = 32
+HEADER = struct.Struct("<4sHHQQ")
+MEDIA_TYPE = "application/vnd.azzamo.blocklist"
+BINARY_MEDIA_TYPES = (MEDIA_TYPE, "application/octet-stream")
+JSON_MEDIA_TYPES = ("application/json", "application/*", "*/*")
+
+HEX_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+def pack(pubkeys, generated_at: int) -> bytes:
+    # Lowercase hex sorts in the same order as the raw bytes, so sort the
+    # strings and convert them in one go
+    keys = sorted({key.lower() for key in pubkeys if len(key) == 2 * KEY_SIZE})
+    try:
+        data = bytes.fromhex("".join(keys))
+    except ValueError:
+        # Only validate key by key when something that is not hex slipped in
+        keys = [key for key in keys if HEX_KEY.match(key)]
+        data = bytes.fromhex("".join(keys))
+    return HEADER.pack(MAGIC, FORMAT_VERSION, KEY_SIZE, len(keys), generated_at) + data
+
+def unpack_header(data) -> dict:
+    magic, version, key_size, count, generated_at = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary blocklist")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported blocklist format version {version}")
+    return {"version": version, "key_size": key_size, "count": count, "generated_at": generated_at}
+
+def contains(data, pubkey: str) -> bool:
+    # Reference lookup for clients; data can be bytes or an mmap
+    header = unpack_header(data)
+    key = bytes.fromhex(pubkey)
+    size = header["key_size"]
+    low, high = 0, header["count"]
+    while low < high:
+        middle = (low + high) // 2
+        offset = HEADER.size + middle * size
+        current = data[offset:offset + size]
+        if current == key:
+            return True
+        if current < key:
+            low = middle + 1
+        else:
+            high = middle
+    return False
+
+def _quality(accept: str, media_types: tuple) -> float:
+    best = 0.0
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if media_type.lower() not in media_types:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        best = max(best, quality)
+    return best
+
+def wants_binary(accept: str | None) -> bool:
+    if not accept:
+        return False
+    binary = _quality(accept, BINARY_MEDIA_TYPES)
+    return binary > 0 and binary >= _quality(accept, JSON_MEDIA_TYPES)
+
+class BinaryBlocklist:
+    def __init__(self, session_factory, max_age: float):
+        self.session_factory = session_factory
+        self.max_age = max_age
+        # (data, etag), replaced as a whole so readers never see a mix
+        self.current = None
+        self._version = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self) -> bool:
+        return self.current is not None and self._version == changes.version("pubkeys") and time.monotonic() - self._built_at < self.max_age
+
+    def get(self) -> tuple[bytes, str]:
+        if not self._fresh():
+            with self._lock:
+                # Concurrent requests wait for a single rebuild
+                if not self._fresh():
+                    self.build()
+        return self.current
+
+    def build(self):
+        # Read the version first; a change committed during the build only
+        # causes another rebuild
+        version = changes.version("pubkeys")
+        db = self.session_factory()
+        try:
+            pubkeys = crud.get_public_blocked_pubkeys(db)
+        finally:
+            db.close()
+        data = pack(pubkeys, int(time.time()))
+        # A weak ETag: the same keys give the same tag whenever they were packed
+        etag = 'W/"' + hashlib.sha256(memoryview(data)[HEADER.size:]).hexdigest()[:32] + '"'
+        self.current = (data, etag)
+        self._version = version
+        self._built_at = time.monotonic()
+
+pubkeys = BinaryBlocklist(SessionLocal, BLOCKLIST_MAX_AGE)
@@ -0,0 +1,235 @@
+from database import SessionLocal
+from models import PublicKey, TempBan
+from sqlalchemy import select
+from dotenv import load_dotenv
+from datetime import datetime
+import changes
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+# Bloom filter over the blocked pubkeys and active temp bans, for relays to
+# pre-check event authors locally and only call /blocked/pubkeys/status on a
+# hit. A Bloom filter has no false negatives, so a miss means the key is
+# neither blocked nor temp banned (as of the filter's generation).
+#
+# Layout (all integers little-endian):
+#
+#   offset  size  field
+#   0       4     magic b"AZBF"
+#   4       2     format version (1)
+#   6       2     number of hash functions k
+#   8       8     number of bits m
+#   16      8     number of keys added
+#   24      8     generation, increases with every change
+#   32      m/8   bit array; bit i is (byte[i >> 3] >> (i & 7)) & 1
+#
+# Pubkeys are already uniformly distributed, so the positions come straight
+# from the raw 32-byte key by double hashing:
+#
+#   h1 = uint64_le(key[0:8]), h2 = uint64_le(key[8:16]) | 1
+#   position_i = (h1 + i * h2) mod m   for i in 0..k-1
+#
+# New bans are added to the live filter as they are published, including the
+# ones other workers make (see changes.py). Removals and expired temp bans
+# cannot be taken out of a Bloom filter; they only add false positives until
+# the next rebuild. The filter is rebuilt from the database in a background
+# thread every BLOOM_MAX_AGE seconds, and is sized with BLOOM_HEADROOM
+# spare capacity so incremental additions keep it near
+# BLOOM_FALSE_POSITIVE_RATE between rebuilds. A rebuild costs a few seconds of
+# CPU per million keys, hence the long default.
+#
+# The ETag hashes everything but the generation, which is local to a worker.
+# Rebuilds are aligned to multiples of BLOOM_MAX_AGE in wall clock time, so the
+# workers behind one address rebuild from the same bans, serve the same filter
+# and answer If-None-Match alike.
+
+load_dotenv()
+
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv("BLOOM_FALSE_POSITIVE_RATE", 0.001))
+BLOOM_MAX_AGE = float(os.getenv("BLOOM_MAX_AGE", 300))  # seconds
+BLOOM_HEADROOM = float(os.getenv("BLOOM_HEADROOM", 0.2))  # spare capacity as a fraction of the keys
+
+MAGIC = b"AZBF"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHQQQ")
+MEDIA_TYPE = "application/vnd.azzamo.bloom"
+GENERATION_OFFSET = 24
+MIN_CAPACITY = 1024
+MAX_HASHES = 32
+
+def parameters(capacity: int, false_positive_rate: float) -> tuple[int, int]:
+    # Optimal bit count rounded up to whole 64-bit words, and hash count
+    bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+    bits = max(64, (bits + 63) // 64 * 64)
+    hashes = min(MAX_HASHES, max(1, round(bits / capacity * math.log(2))))
+    return bits, hashes
+
+def _key_bytes(pubkey: str) -> bytes | None:
+    try:
+        key = bytes.fromhex(pubkey)
+    except ValueError:
+        return None
+    return key if len(key) == 32 else None
+
+class BloomFilter:
+    def __init__(self, bits: int, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.count = 0
+        self.array = bytearray(bits // 8)
+
+    def add_many(self, keys):
+        array, bits, hashes = self.array, self.bits, self.hashes
+        added = 0
+        for key in keys:
+            h1 = int.from_bytes(key[0:8], "little")
+            h2 = int.from_bytes(key[8:16], "little") | 1
+            for i in range(hashes):
+                position = (h1 + i * h2) % bits
+                array[position >> 3] |= 1 << (position & 7)
+            added += 1
+        self.count += added
+
+    def __contains__(self, key: bytes) -> bool:
+        h1 = int.from_bytes(key[0:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.bits
+            if not self.array[position >> 3] >> (position & 7) & 1:
+                return False
+        return True
+
+    def estimated_false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def pack(self, generation: int) -> bytes:
+        return HEADER.pack(MAGIC, FORMAT_VERSION, self.hashes, self.bits, self.count, generation) + bytes(self.array)
+
+def unpack(data) -> tuple[dict, BloomFilter]:
+    magic, version, hashes, bits, count, generation = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a Bloom filter")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported Bloom filter format version {version}")
+    bloom = BloomFilter(bits, hashes)
+    bloom.array[:] = data[HEADER.size:HEADER.size + bits // 8]
+    bloom.count = count
+    return {"version": version, "hashes": hashes, "bits": bits, "count": count, "generation": generation}, bloom
+
+class BanFilter:
+    def __init__(self, session_factory, false_positive_rate: float, max_age: float, headroom: float):
+        self.session_factory = session_factory
+        self.false_positive_rate = false_positive_rate
+        self.max_age = max_age
+        self.headroom = headroom
+        self.filter = None
+        self.generation = 0
+        self.built_at = 0.0
+        self._built_period = None
+        self._packed = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._first_build_lock = threading.Lock()
+        self._added_during_build = None
+        self._rebuilding = False
+        changes.subscribe("pubkeys", self._on_change)
+        changes.subscribe("temp_bans", self._on_change)
+
+    def _on_change(self, added, removed):
+        keys = [key for key in map(_key_bytes, added) if key is not None]
+        if not keys:
+            return
+        with self._lock:
+            if self._added_during_build is not None:
+                self._added_during_build.extend(keys)
+            if self.filter is not None:
+                self.filter.add_many(keys)
+                self.generation += 1
+                self._packed = None
+
+    def _load_keys(self) -> list[bytes]:
+        db = self.session_factory()
+        try:
+            pubkeys = db.execute(select(PublicKey.pubkey)).scalars().all()
+            temp_banned = db.execute(select(TempBan.pubkey).where(TempBan.expiry_timestamp > datetime.utcnow())).scalars().all()
+        finally:
+            db.close()
+        return [key for key in map(_key_bytes, set(pubkeys).union(temp_banned)) if key is not None]
+
+    def build(self):
+        with self._build_lock:
+            # Bans published while the database is read are replayed onto the
+            # new filter before it replaces the old one
+            with self._lock:
+                self._added_during_build = []
+            try:
+                started = time.perf_counter()
+                keys = self._load_keys()
+                capacity = max(MIN_CAPACITY, math.ceil(len(keys) * (1 + self.headroom)))
+                bloom = BloomFilter(*parameters(capacity, self.false_positive_rate))
+                bloom.add_many(keys)
+                with self._lock:
+                    bloom.add_many(self._added_during_build)
+                    self.filter = bloom
+                    self.generation = max(self.generation + 1, int(time.time()))
+                    self.built_at = time.monotonic()
+                    self._built_period = self._period()
+                    self._packed = None
+                logging.info(f"Built Bloom filter over {bloom.count} pubkeys: {bloom.bits} bits, {bloom.hashes} hashes in {time.perf_counter() - started:.2f}s")
+            finally:
+                with self._lock:
+                    self._added_during_build = None
+
+    def _period(self) -> int:
+        return int(time.time() // self.max_age) if self.max_age > 0 else 0
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception as e:
+            logging.error(f"Error rebuilding Bloom filter: {e}")
+        finally:
+            self._rebuilding = False
+
+    def get(self) -> tuple[bytes, str]:
+        if self.filter is None:
+            # Nothing to serve yet, so the first requests wait for one build
+            with self._first_build_lock:
+                if self.filter is None:
+                    self.build()
+        elif self._period() != self._built_period and not self._rebuilding:
+            # Keep serving the current filter while a fresh one is built
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, name="bloom-rebuild", daemon=True).start()
+
+        with self._lock:
+            if self._packed is None:
+                data = self.filter.pack(self.generation)
+                digest = hashlib.sha256(memoryview(data)[:GENERATION_OFFSET])
+                digest.update(memoryview(data)[HEADER.size:])
+                # A weak ETag: the same filter gives the same tag in every worker
+                self._packed = (data, 'W/"' + digest.hexdigest()[:32] + '"')
+            return self._packed
+
+    def status(self) -> dict:
+        bloom = self.filter
+        if bloom is None:
+            return {"built": False}
+        return {
+            "built": True,
+            "generation": self.generation,
+            "keys": bloom.count,
+            "bits": bloom.bits,
+            "hashes": bloom.hashes,
+            "size_bytes": HEADER.size + bloom.bits // 8,
+            "target_false_positive_rate": self.false_positive_rate,
+            "estimated_false_positive_rate": bloom.estimated_false_positive_rate(),
+            "age_seconds": round(time.monotonic() - self.built_at, 1)
+        }
+
+ban_filter = BanFilter(SessionLocal, BLOOM_FALSE_POSITIVE_RATE, BLOOM_MAX_AGE, BLOOM_HEADROOM)
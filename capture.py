@@ -0,0 +1,262 @@
+from dotenv import load_dotenv
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+import atexit
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qsl
+
+# Optional traffic capture for benchmarks/replay.py.
+#
+# CaptureMiddleware samples CAPTURE_SAMPLE_RATE of the requests and records
+# method, route, path, query, body hash, status and latency. Records are handed
+# to a background writer through an in-memory deque, so a request never waits
+# for disk; the writer appends them to JSONL files in CAPTURE_DIR and starts a
+# new file every CAPTURE_MAX_BYTES, keeping the newest CAPTURE_MAX_FILES. A
+# worker only deletes its own files and those of workers that have exited.
+#
+# Captures are anonymized before they are queued. API keys and client IPs are
+# never recorded, and pubkeys, npubs, IPs and free-text values are replaced by
+# pseudonyms keyed with CAPTURE_SALT. A pubkey always maps to the same
+# pseudonymous pubkey, so replays keep the hot-key distribution of the real
+# traffic. Without CAPTURE_SALT a random salt is used, which only lines up
+# within one worker process. Bodies are only kept (pseudonymized the same way)
+# with CAPTURE_BODIES=True; otherwise the replay tool skips requests with a
+# body.
+
+load_dotenv()
+
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "False").lower() == "true"
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", 0.01))
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "captures")
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", 64 * 1024 * 1024))
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", 20))
+CAPTURE_BODIES = os.getenv("CAPTURE_BODIES", "False").lower() == "true"
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")
+
+CAPTURE_MAX_BUFFER = 10000
+CAPTURE_FLUSH_INTERVAL = 1.0  # seconds
+CAPTURE_MAX_BODY = 64 * 1024  # larger bodies are hashed but never kept
+CAPTURE_EXCLUDED_PATHS = ("/metrics",)
+
+# Values of these parameters and body fields carry no user data and are kept
+# as they are, since the endpoints behave differently depending on them
+PLAIN_FIELDS = {"entity_type", "hours", "limit", "cursor", "start", "end", "action", "status", "duration"}
+
+HEX_KEY = re.compile(r"^[0-9a-fA-F]{64}$")
+IPV4 = re.compile(r"^\d{1,3}(\.\d{1,3}){3}$")
+
+_salt = CAPTURE_SALT.encode() or os.urandom(32)
+
+def _digest(value: str) -> bytes:
+    return hmac.new(_salt, value.encode(), hashlib.sha256).digest()
+
+def anonymize(value: str) -> str:
+    # Pseudonyms keep the shape of the original so they still pass validation
+    if HEX_KEY.match(value):
+        return _digest(value.lower()).hex()
+    if value.startswith("npub1"):
+        return _digest(value).hex()
+    if IPV4.match(value):
+        digest = _digest(value)
+        return f"10.{digest[0]}.{digest[1]}.{digest[2]}"
+    return "anon-" + _digest(value).hex()[:16]
+
+def anonymize_json(value, field: str | None = None):
+    if isinstance(value, dict):
+        return {key: anonymize_json(item, key) for key, item in value.items()}
+    if isinstance(value, list):
+        return [anonymize_json(item, field) for item in value]
+    if isinstance(value, str) and field not in PLAIN_FIELDS:
+        return anonymize(value)
+    return value
+
+def _anonymize_path(scope) -> tuple[str | None, str]:
+    route = getattr(scope.get("route"), "path", None)
+    if route is not None:
+        path = route
+        for name, value in scope.get("path_params", {}).items():
+            path = path.replace("{" + name + "}", anonymize(str(value)))
+        return route, path
+    # Unmatched paths have no template, so pseudonymize anything that looks like data
+    segments = [anonymize(segment) if HEX_KEY.match(segment) or IPV4.match(segment) or segment.startswith("npub1") else segment for segment in scope["path"].split("/")]
+    return None, "/".join(segments)
+
+def _anonymize_query(query_string: bytes) -> dict:
+    query = {}
+    for name, value in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True):
+        query[name] = value if name in PLAIN_FIELDS else anonymize(value)
+    return query
+
+def _prunable(path: str) -> bool:
+    # Capture files written by this process or by one that has exited
+    match = re.search(r"-(\d+)\.jsonl$", path)
+    if match is None:
+        return False
+    pid = int(match.group(1))
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # Running, but owned by another user
+        return False
+    return False
+
+class CaptureWriter:
+    def __init__(self, directory: str, max_bytes: int, max_files: int, max_buffer: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._file = None
+        self._written = 0
+
+    def record(self, entry: dict):
+        with self._lock:
+            if self._stopped:
+                return
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def flush(self) -> int:
+        with self._lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+        if not batch:
+            return 0
+        try:
+            for entry in batch:
+                if self._file is None or self._written >= self.max_bytes:
+                    self._rotate()
+                line = json.dumps(entry, separators=(",", ":")) + "\n"
+                self._file.write(line)
+                self._written += len(line)
+            self._file.flush()
+        except OSError as e:
+            logging.error(f"Error writing {len(batch)} captured requests: {e}")
+            return 0
+        return len(batch)
+
+    def stop(self, timeout: float = 5.0):
+        with self._lock:
+            self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.dropped:
+            logging.warning(f"{self.dropped} captured requests were dropped because the buffer was full")
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        # The pid keeps the files of several workers apart
+        name = f"capture-{datetime.utcnow():%Y%m%d-%H%M%S}-{os.getpid()}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "a")
+        self._written = 0
+
+        files = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl")), key=os.path.getmtime)
+        for path in files[:max(0, len(files) - self.max_files)]:
+            # Files of other running workers are theirs to prune, one of them is still open
+            if not _prunable(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(CAPTURE_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+writer = CaptureWriter(CAPTURE_DIR, CAPTURE_MAX_BYTES, CAPTURE_MAX_FILES, CAPTURE_MAX_BUFFER)
+
+class CaptureMiddleware:
+    def __init__(self, app, sample_rate: float = CAPTURE_SAMPLE_RATE, capture_bodies: bool = CAPTURE_BODIES):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.capture_bodies = capture_bodies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in CAPTURE_EXCLUDED_PATHS or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        timestamp = time.time()
+        status = 500
+        body_hash = hmac.new(_salt, digestmod=hashlib.sha256)
+        body_size = 0
+        body_chunks = []
+
+        async def receive_with_body():
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_hash.update(chunk)
+                body_size += len(chunk)
+                if self.capture_bodies and body_size <= CAPTURE_MAX_BODY:
+                    body_chunks.append(chunk)
+            return message
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_body, send_with_status)
+        finally:
+            route, path = _anonymize_path(scope)
+            entry = {
+                "ts": round(timestamp, 6),
+                "method": scope["method"],
+                "route": route,
+                "path": path,
+                "query": _anonymize_query(scope.get("query_string", b"")),
+                "body_sha256": body_hash.hexdigest() if body_size else None,
+                "body_size": body_size,
+                "status": status,
+                "latency_ms": round((perf_counter() - start) * 1000, 3)
+            }
+            if body_chunks and body_size <= CAPTURE_MAX_BODY:
+                try:
+                    entry["body"] = anonymize_json(json.loads(b"".join(body_chunks)))
+                except ValueError:
+                    pass
+            writer.record(entry)
+
+def stop():
+    writer.stop()
@@ -0,0 +1,273 @@
+from models import BanChange
+from database import SessionLocal, engine
+from sqlalchemy import delete, func, insert, or_, select, text
+from dotenv import load_dotenv
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+import atexit
+import json
+import logging
+import os
+import select as select_module
+import threading
+import time
+import uuid
+
+# Change feed for the ban lists.
+#
+# crud.py publishes every committed change to a list here. Anything derived
+# from a list either remembers the version it was built from and rebuilds once
+# version(topic) has moved on (the binary blocklist export), or subscribes and
+# applies the added and removed entries as they come in (the Bloom filter).
+#
+# Topics: pubkeys, temp_bans, words, ips
+#
+# Changes are also broadcast to the other API processes. A background thread
+# appends published changes to the ban_changes table and reads the rows
+# written by other processes, which are applied exactly like local changes.
+# On Postgres the writer sends a NOTIFY on the ban_changes channel with the
+# commit and every process LISTENs on it, so remote changes arrive within
+# milliseconds; the table is still polled every CHANGES_FALLBACK_INTERVAL
+# seconds in case a notification is missed while reconnecting. SQLite has no
+# notifications, so the table is polled every CHANGES_POLL_INTERVAL seconds.
+#
+# Postgres sequence values can commit out of order, so each poll reads the
+# rows after the newest id seen so far plus the ids it skipped over within the
+# last REORDER_WINDOW ids, in case they commit later. Rows older than
+# CHANGES_RETENTION seconds are deleted, except the newest one, which keeps the
+# ids growing.
+
+load_dotenv()
+
+CHANGES_BROADCAST = os.getenv("CHANGES_BROADCAST", "True").lower() == "true"
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", 0.5))  # seconds
+CHANGES_FALLBACK_INTERVAL = float(os.getenv("CHANGES_FALLBACK_INTERVAL", 5))  # seconds, with LISTEN/NOTIFY
+CHANGES_RETENTION = int(os.getenv("CHANGES_RETENTION", 3600))  # seconds
+
+CHANNEL = "ban_changes"
+REORDER_WINDOW = 1000
+MAX_PENDING = 10000
+PRUNE_INTERVAL = 300  # seconds
+
+# Every process is its own node, since every process has its own caches
+NODE_ID = uuid.uuid4().hex
+
+_lock = threading.Lock()
+_versions = defaultdict(int)
+_subscribers = defaultdict(list)
+
+def subscribe(topic: str, callback):
+    # callback(added, removed) runs in the publishing thread, after the commit,
+    # or in the change feed thread for changes made by other processes
+    with _lock:
+        _subscribers[topic].append(callback)
+
+def unsubscribe(topic: str, callback):
+    with _lock:
+        if callback in _subscribers[topic]:
+            _subscribers[topic].remove(callback)
+
+def _apply(topic: str, added, removed):
+    with _lock:
+        _versions[topic] += 1
+        callbacks = list(_subscribers[topic])
+    for callback in callbacks:
+        try:
+            callback(added, removed)
+        except Exception as e:
+            logging.error(f"Error handling {topic} change: {e}")
+
+def publish(topic: str, added: list[str] = (), removed: list[str] = ()):
+    _apply(topic, added, removed)
+    if CHANGES_BROADCAST:
+        feed.send(topic, list(added), list(removed))
+
+def version(topic: str) -> int:
+    return _versions[topic]
+
+class ChangeFeed:
+    def __init__(self, engine, session_factory, node_id: str = NODE_ID):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.node_id = node_id
+        self.notifications = engine.dialect.name == "postgresql"
+        self.last_seen = None
+        self.received = 0
+        self.dropped = 0
+        # Ids below last_seen that have not been read yet
+        self._missing = set()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._listener = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self._stopped or not CHANGES_BROADCAST:
+                return
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+            if self.notifications:
+                self._listener = threading.Thread(target=self._listen, name="change-feed-listener", daemon=True)
+                self._listener.start()
+            atexit.register(self.stop)
+
+    def send(self, topic: str, added: list, removed: list):
+        with self._lock:
+            if len(self._pending) >= MAX_PENDING:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append({
+                "topic": topic,
+                "origin": self.node_id,
+                "added": json.dumps(added),
+                "removed": json.dumps(removed),
+                "created_at": datetime.utcnow()
+            })
+        self.start()
+        self._wakeup.set()
+
+    def flush(self) -> int:
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch = list(self._pending)
+            self._pending.clear()
+
+        db = self.session_factory()
+        try:
+            db.execute(insert(BanChange), batch)
+            if self.notifications:
+                # Delivered to the listeners when the insert commits
+                db.execute(text("SELECT pg_notify(:channel, :origin)"), {"channel": CHANNEL, "origin": self.node_id})
+            db.commit()
+            return len(batch)
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Error broadcasting {len(batch)} ban list changes: {e}")
+            with self._lock:
+                self._pending.extendleft(reversed(batch))
+                while len(self._pending) > MAX_PENDING:
+                    self._pending.popleft()
+                    self.dropped += 1
+            return 0
+        finally:
+            db.close()
+
+    def poll(self) -> int:
+        db = self.session_factory()
+        try:
+            if self.last_seen is None:
+                # Only changes made after this process started are of interest
+                self.last_seen = db.execute(select(func.max(BanChange.id))).scalar() or 0
+                return 0
+            condition = BanChange.id > self.last_seen
+            if self._missing:
+                condition = or_(condition, BanChange.id.in_(sorted(self._missing)))
+            rows = db.execute(
+                select(BanChange.id, BanChange.topic, BanChange.origin, BanChange.added, BanChange.removed)
+                .where(condition)
+                .order_by(BanChange.id)
+            ).all()
+        finally:
+            db.close()
+
+        applied = 0
+        for change_id, topic, origin, added, removed in rows:
+            if change_id > self.last_seen:
+                # Ids skipped over may still be committed by slower writers
+                self._missing.update(range(max(self.last_seen + 1, change_id - REORDER_WINDOW), change_id))
+                self.last_seen = change_id
+            else:
+                self._missing.discard(change_id)
+            if origin == self.node_id:
+                continue
+            _apply(topic, json.loads(added or "[]"), json.loads(removed or "[]"))
+            applied += 1
+        self._missing = {change_id for change_id in self._missing if change_id > self.last_seen - REORDER_WINDOW}
+        self.received += applied
+        return applied
+
+    def prune(self):
+        db = self.session_factory()
+        try:
+            # The newest row is always kept: SQLite hands out max(id) + 1, so an
+            # empty table would restart the ids below every worker's last_seen
+            newest = select(func.max(BanChange.id)).scalar_subquery()
+            db.execute(delete(BanChange).where(BanChange.created_at < datetime.utcnow() - timedelta(seconds=CHANGES_RETENTION), BanChange.id < newest))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Error pruning ban list changes: {e}")
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.flush()
+        if self.dropped:
+            logging.warning(f"{self.dropped} ban list changes were not broadcast because the buffer was full")
+
+    def _run(self):
+        interval = CHANGES_FALLBACK_INTERVAL if self.notifications else CHANGES_POLL_INTERVAL
+        pruned_at = time.monotonic()
+        try:
+            self.poll()
+        except Exception as e:
+            logging.error(f"Error reading ban list changes: {e}")
+        while not self._stopped:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.flush()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Error reading ban list changes: {e}")
+            if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                self.prune()
+
+    def _listen(self):
+        while not self._stopped:
+            connection = None
+            try:
+                connection = self.engine.raw_connection()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}")
+                # Catch up on anything sent while (re)connecting
+                self._wakeup.set()
+                while not self._stopped:
+                    if select_module.select([dbapi_connection], [], [], 1.0)[0]:
+                        dbapi_connection.poll()
+                        if any(notify.payload != self.node_id for notify in dbapi_connection.notifies):
+                            self._wakeup.set()
+                        dbapi_connection.notifies.clear()
+            except Exception as e:
+                logging.error(f"Ban list change listener failed, reconnecting: {e}")
+                time.sleep(1)
+            finally:
+                if connection is not None:
+                    # The connection is in LISTEN mode, don't hand it back to the pool
+                    connection.invalidate()
+
+feed = ChangeFeed(engine, SessionLocal)
+
+def status() -> dict:
+    return {
+        "node": feed.node_id,
+        "broadcast": CHANGES_BROADCAST,
+        "notifications": feed.notifications,
+        "last_seen": feed.last_seen,
+        "received": feed.received,
+        "pending": len(feed._pending),
+        "dropped": feed.dropped
+    }
+
+def stop():
+    feed.stop()
@@ -1,23 +1,43 @@
-from database import SessionLocal
-from models import PublicKey, TempBan, Word, IPAddress, Moderator, AuditLog, UserReport
+from database import SessionLocal, use_replica
+from models import PublicKey, TempBan, Word, IPAddress, Moderator, AuditLog, UserReport, ReportAggregate, ReportReporter
 from schemas import PublicKeyCreate, TempBanCreate, UserReportCreate, UserReportUpdate, ReportApproval
 from datetime import datetime, timedelta
-from pynostr.key import PublicKey as NostrPublicKey
 from fastapi import HTTPException, Depends
 import logging
-import requests
 import os
 from dependencies import get_api_key
 from sqlalchemy.orm import Session
+from sqlalchemy import String, case, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import schemas
+import report_aggregation
+import audit
+import stats
+import changes
+# pubkey_set must see a ban before lookups clears the cached statuses
+import pubkey_set
+import lookups
+import serialization
 
 def convert_npub_to_hex(npub: str) -> str:
-    # Convert Npub to hex using pynostr
+    # Convert Npub to hex using pynostr, imported on first use to keep startup fast
+    from pynostr.key import PublicKey as NostrPublicKey
     public_key = NostrPublicKey.from_npub(npub)
     return public_key.hex()
 
+def audit_action(db: SessionLocal, action: str, target: str, before: dict | None = None, after: dict | None = None):
+    # get_api_key stores the acting moderator on the request's session
+    audit.record(action, db.info.get("moderator_name"), target, before, after)
+
+@use_replica
 def get_blocked_pubkeys(db: SessionLocal):
-    return db.query(PublicKey).all()
+    # Plain rows of the response columns, encoded by serialization.rows_response
+    return db.execute(select(*serialization.columns(PublicKey, schemas.PublicKey))).all()
+
+@use_replica
+def get_public_blocked_pubkeys(db: SessionLocal) -> list[str]:
+    return db.execute(select(PublicKey.pubkey)).scalars().all()
 
 def add_blocked_pubkey(db: SessionLocal, pubkey: PublicKeyCreate):
     # Check if the pubkey is in Npub format and convert it
@@ -33,6 +53,7 @@ def add_blocked_pubkey(db: SessionLocal, pubkey: PublicKeyCreate):
             existing_pubkey.ban_reason = pubkey.ban_reason
             db.commit()
             db.refresh(existing_pubkey)
+            audit_action(db, "update_ban_reason", hex_pubkey, {"ban_reason": None}, {"ban_reason": pubkey.ban_reason})
         return {
             "message": "Public key already blocked",
             "status": "already_blocked",
@@ -45,6 +66,9 @@ def add_blocked_pubkey(db: SessionLocal, pubkey: PublicKeyCreate):
     db.add(db_pubkey)
     db.commit()
     db.refresh(db_pubkey)
+    audit_action(db, "ban_pubkey", hex_pubkey, None, {"ban_reason": db_pubkey.ban_reason})
+    stats.cache.ban_added(db_pubkey.timestamp)
+    changes.publish("pubkeys", added=[hex_pubkey])
     return {
         "message": "Public key successfully blocked",
         "status": "blocked",
@@ -56,49 +80,125 @@ def add_blocked_pubkey(db: SessionLocal, pubkey: PublicKeyCreate):
 def remove_blocked_pubkey(db: SessionLocal, pubkey: PublicKeyCreate):
     db_pubkey = db.query(PublicKey).filter(PublicKey.pubkey == pubkey.pubkey).first()
     if db_pubkey:
+        before = {"ban_reason": db_pubkey.ban_reason}
+        banned_at = db_pubkey.timestamp
         db.delete(db_pubkey)
         db.commit()
+        audit_action(db, "unban_pubkey", pubkey.pubkey, before, None)
+        stats.cache.ban_removed(banned_at)
+        changes.publish("pubkeys", removed=[pubkey.pubkey])
+
+def _extend_expiry(dialect: str, hours: int):
+    # expiry_timestamp + hours, evaluated by the database
+    if dialect == "sqlite":
+        # Stored as text in SQLAlchemy's "YYYY-MM-DD HH:MM:SS.ffffff" format
+        return func.strftime("%Y-%m-%d %H:%M:%f", TempBan.expiry_timestamp, f"+{hours} hours", type_=String).concat("000")
+    return TempBan.expiry_timestamp + timedelta(hours=hours)
+
+def _temp_ban_hex_pubkey(pubkey: str, entry: str = "pubkey") -> str:
+    # A malformed npub is the caller's mistake, not a server error
+    if not pubkey.startswith("npub"):
+        return pubkey
+    try:
+        return convert_npub_to_hex(pubkey)
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Invalid npub in {entry}: {pubkey}")
+
+def _upsert_temp_ban(db: SessionLocal, hex_pubkey: str, pubkey: TempBanCreate, now: datetime) -> dict:
+    expiry = now + timedelta(hours=pubkey.duration)
+
+    # One INSERT ... ON CONFLICT DO UPDATE, so concurrent bans of the same key
+    # neither hit the unique constraint nor lose an extension. An active ban
+    # is extended from its current expiry, an expired one starts over from now.
+    dialect = db.get_bind().dialect.name
+    insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+    statement = insert(TempBan).values(pubkey=hex_pubkey, expiry_timestamp=expiry, ban_reason=pubkey.ban_reason, ban_count=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=[TempBan.pubkey],
+        set_={
+            "expiry_timestamp": case((TempBan.expiry_timestamp > now, _extend_expiry(dialect, pubkey.duration)), else_=statement.excluded.expiry_timestamp),
+            "ban_reason": func.coalesce(statement.excluded.ban_reason, TempBan.ban_reason),
+            "ban_count": TempBan.ban_count + 1
+        }
+    ).returning(TempBan.expiry_timestamp, TempBan.ban_reason, TempBan.ban_count)
+    new_expiry, ban_reason, ban_count = db.execute(statement).one()
+    return {
+        "pubkey": hex_pubkey,
+        "duration": pubkey.duration,
+        "expiry_timestamp": new_expiry,
+        "ban_reason": ban_reason,
+        "ban_count": ban_count,
+        "created": ban_count == 1,
+        "extended": new_expiry > expiry
+    }
 
-def temp_ban_pubkey(db: SessionLocal, pubkey: TempBanCreate):
-    # Check if the public key is already temporarily banned
-    existing_temp_ban = db.query(TempBan).filter(TempBan.pubkey == pubkey.pubkey).first()
-    
-    if existing_temp_ban:
-        # Extend the existing ban duration
-        existing_temp_ban.expiry_timestamp += timedelta(hours=pubkey.duration)
-        db.commit()
-        db.refresh(existing_temp_ban)
+def _temp_ban_committed(db: SessionLocal, ban: dict) -> dict:
+    # Audit, stats and change feed hooks for a committed upsert
+    if ban["extended"]:
+        before = {"expiry_timestamp": ban["expiry_timestamp"] - timedelta(hours=ban["duration"])}
+        audit_action(db, "extend_temp_ban", ban["pubkey"], before, {"expiry_timestamp": ban["expiry_timestamp"], "ban_reason": ban["ban_reason"]})
+    else:
+        audit_action(db, "temp_ban_pubkey", ban["pubkey"], None, {"expiry_timestamp": ban["expiry_timestamp"], "ban_reason": ban["ban_reason"]})
+    stats.cache.temp_ban_set(ban["pubkey"], ban["expiry_timestamp"], created=ban["created"])
+
+    if ban["extended"]:
         return {
             "message": "Temporary ban extended",
             "status": "extended",
-            "pubkey": existing_temp_ban.pubkey,
-            "new_expiry_timestamp": existing_temp_ban.expiry_timestamp
+            "pubkey": ban["pubkey"],
+            "new_expiry_timestamp": ban["expiry_timestamp"],
+            "ban_reason": ban["ban_reason"]
         }
-    else:
-        # Create a new temporary ban
-        expiry = datetime.utcnow() + timedelta(hours=pubkey.duration)
-        db_temp_ban = TempBan(pubkey=pubkey.pubkey, expiry_timestamp=expiry)
-        db.add(db_temp_ban)
+    return {
+        "message": "Temporary ban applied",
+        "status": "banned",
+        "pubkey": ban["pubkey"],
+        "expiry_timestamp": ban["expiry_timestamp"],
+        "ban_reason": ban["ban_reason"]
+    }
+
+def temp_ban_pubkey(db: SessionLocal, pubkey: TempBanCreate):
+    ban = _upsert_temp_ban(db, _temp_ban_hex_pubkey(pubkey.pubkey), pubkey, datetime.utcnow())
+    db.commit()
+    result = _temp_ban_committed(db, ban)
+    if not ban["extended"]:
+        changes.publish("temp_bans", added=[ban["pubkey"]])
+    return result
+
+def temp_ban_pubkeys(db: SessionLocal, pubkeys: list[TempBanCreate]):
+    # All bans are applied in one transaction and committed together, so every
+    # key is checked before the first one is written
+    hex_pubkeys = [_temp_ban_hex_pubkey(pubkey.pubkey, f"bans[{index}]") for index, pubkey in enumerate(pubkeys)]
+    now = datetime.utcnow()
+    try:
+        bans = [_upsert_temp_ban(db, hex_pubkey, pubkey, now) for hex_pubkey, pubkey in zip(hex_pubkeys, pubkeys)]
         db.commit()
-        db.refresh(db_temp_ban)
-        
-        # Update the ban reason if provided
-        if pubkey.ban_reason:
-            update_ban_reason(db, pubkey.pubkey, pubkey.ban_reason)
-        
-        return {
-            "message": "Temporary ban applied",
-            "status": "banned",
-            "pubkey": db_temp_ban.pubkey,
-            "expiry_timestamp": db_temp_ban.expiry_timestamp
-        }
+    except Exception:
+        db.rollback()
+        raise
+    results = [_temp_ban_committed(db, ban) for ban in bans]
+    added = list(dict.fromkeys(ban["pubkey"] for ban in bans if not ban["extended"]))
+    if added:
+        changes.publish("temp_bans", added=added)
+    return {
+        "banned": sum(1 for result in results if result["status"] == "banned"),
+        "extended": sum(1 for result in results if result["status"] == "extended"),
+        "results": results
+    }
 
 def remove_temp_ban(db: SessionLocal, pubkey: PublicKeyCreate):
-    db_temp_ban = db.query(TempBan).filter(TempBan.pubkey == pubkey.pubkey).first()
+    hex_pubkey = convert_npub_to_hex(pubkey.pubkey) if pubkey.pubkey.startswith("npub") else pubkey.pubkey
+    db_temp_ban = db.query(TempBan).filter(TempBan.pubkey == hex_pubkey).first()
     if db_temp_ban:
+        before = {"expiry_timestamp": db_temp_ban.expiry_timestamp, "ban_reason": db_temp_ban.ban_reason}
         db.delete(db_temp_ban)
         db.commit()
+        audit_action(db, "remove_temp_ban", hex_pubkey, before, None)
+        stats.cache.temp_ban_removed(hex_pubkey)
+        changes.publish("temp_bans", removed=[hex_pubkey])
 
+@lookups.coalesced(lookups.pubkey_status)
+@use_replica
 def check_pubkey_status(db: SessionLocal, pubkey: str):
     # Convert Npub to hex if necessary
     if pubkey.startswith("npub"):
@@ -106,6 +206,11 @@ def check_pubkey_status(db: SessionLocal, pubkey: str):
     else:
         hex_pubkey = pubkey
 
+    # Most checks are for keys that are not banned, which the shared packed
+    # set answers without a query
+    if pubkey_set.PUBKEY_SET_ENABLED and hex_pubkey not in pubkey_set.banned:
+        return {"status": "not_blocked"}
+
     # Check if the public key is blocked
     blocked_pubkey = db.query(PublicKey).filter(PublicKey.pubkey == hex_pubkey).first()
     if blocked_pubkey:
@@ -125,10 +230,12 @@ def update_ban_reason(db: SessionLocal, pubkey: str, reason: str, moderator_name
     hex_pubkey = convert_npub_to_hex(pubkey) if pubkey.startswith("npub") else pubkey
     db_pubkey = db.query(PublicKey).filter(PublicKey.pubkey == hex_pubkey).first()
     if db_pubkey:
+        before = {"ban_reason": db_pubkey.ban_reason}
         db_pubkey.ban_reason = reason
         db_pubkey.moderator_name = moderator_name
         db.commit()
         db.refresh(db_pubkey)
+        audit_action(db, "update_ban_reason", hex_pubkey, before, {"ban_reason": reason})
         return db_pubkey
     raise HTTPException(status_code=404, detail="Public key not found")
 
@@ -136,9 +243,11 @@ def remove_ban_reason(db: SessionLocal, pubkey: str):
     hex_pubkey = convert_npub_to_hex(pubkey) if pubkey.startswith("npub") else pubkey
     db_pubkey = db.query(PublicKey).filter(PublicKey.pubkey == hex_pubkey).first()
     if db_pubkey:
+        before = {"ban_reason": db_pubkey.ban_reason}
         db_pubkey.ban_reason = None
         db.commit()
         db.refresh(db_pubkey)
+        audit_action(db, "remove_ban_reason", hex_pubkey, before, {"ban_reason": None})
         return db_pubkey
     raise HTTPException(status_code=404, detail="Public key not found")
 
@@ -151,6 +260,9 @@ def add_blacklisted_word(db: SessionLocal, word: str):
     db.add(db_word)
     db.commit()
     db.refresh(db_word)
+    audit_action(db, "blacklist_word", word)
+    stats.cache.incr("blocked_words")
+    changes.publish("words", added=[word])
     return {"message": "Word successfully blacklisted", "status": "blacklisted", "word": db_word.word}
 
 def remove_blacklisted_word(db: SessionLocal, word: str):
@@ -158,6 +270,9 @@ def remove_blacklisted_word(db: SessionLocal, word: str):
     if db_word:
         db.delete(db_word)
         db.commit()
+        audit_action(db, "unblacklist_word", word)
+        stats.cache.incr("blocked_words", -1)
+        changes.publish("words", removed=[word])
         return {"message": "Word removed from blacklist"}
     raise HTTPException(status_code=404, detail="Word not found")
 
@@ -170,18 +285,34 @@ def add_blocked_ip(db: SessionLocal, ip: str, ban_reason: str = None):
     db.add(db_ip)
     db.commit()
     db.refresh(db_ip)
+    audit_action(db, "block_ip", ip, None, {"ban_reason": ban_reason})
+    stats.cache.incr("blocked_ips")
+    changes.publish("ips", added=[ip])
     return db_ip
 
 def remove_blocked_ip(db: SessionLocal, ip: str):
     db_ip = db.query(IPAddress).filter(IPAddress.ip == ip).first()
     if db_ip:
+        before = {"ban_reason": db_ip.ban_reason}
         db.delete(db_ip)
         db.commit()
+        audit_action(db, "unblock_ip", ip, before, None)
+        stats.cache.incr("blocked_ips", -1)
+        changes.publish("ips", removed=[ip])
         return {"message": "IP address removed from blacklist"}
     raise HTTPException(status_code=404, detail="IP address not found")
 
+@use_replica
 def get_blocked_words(db: SessionLocal):
-    return db.query(Word).all()
+    return db.execute(select(*serialization.columns(Word, schemas.Word))).all()
+
+@use_replica
+def get_public_blocked_words(db: SessionLocal) -> list[str]:
+    return db.execute(select(Word.word)).scalars().all()
+
+@use_replica
+def get_blocked_ips(db: SessionLocal):
+    return db.execute(select(*serialization.columns(IPAddress, schemas.IPAddress))).all()
 
 def add_moderator(db: SessionLocal, name: str, private_key: str):
     # Check if a moderator with the same name already exists
@@ -194,6 +325,7 @@ def add_moderator(db: SessionLocal, name: str, private_key: str):
     db.add(db_moderator)
     db.commit()
     db.refresh(db_moderator)
+    audit_action(db, "add_moderator", name)
     return {"message": "Moderator added successfully", "status": "added", "name": db_moderator.name}
 
 def remove_moderator(db: SessionLocal, name: str):
@@ -201,12 +333,14 @@ def remove_moderator(db: SessionLocal, name: str):
     if db_moderator:
         db.delete(db_moderator)
         db.commit()
+        audit_action(db, "remove_moderator", name)
         return {"message": "Moderator removed"}
     raise HTTPException(status_code=404, detail="Moderator not found")
 
 def list_moderators(db: SessionLocal):
     return db.query(Moderator).all()
 
+@use_replica
 def search_blocked_entities(db: SessionLocal, entity_type: str, query: str):
     if entity_type == "pubkey":
         return db.query(PublicKey).filter(PublicKey.pubkey.contains(query)).all()
@@ -241,17 +375,10 @@ def bulk_remove_blocked_entities(db: SessionLocal, entity_type: str, entities: l
     return {"message": "Entities removed successfully"}
 
 def get_statistics(db: SessionLocal):
-    pubkey_count = db.query(PublicKey).count()
-    ip_count = db.query(IPAddress).count()
-    word_count = db.query(Word).count()
-    temp_ban_count = db.query(TempBan).count()
-    return {
-        "blocked_pubkeys": pubkey_count,
-        "blocked_ips": ip_count,
-        "blocked_words": word_count,
-        "temporary_bans": temp_ban_count
-    }
+    # Served from memory, see stats.py
+    return stats.cache.snapshot()
 
+@use_replica
 def get_expiring_temp_bans(db: SessionLocal, hours: int):
     expiry_threshold = datetime.utcnow() + timedelta(hours=hours)
     return db.query(TempBan).filter(TempBan.expiry_timestamp <= expiry_threshold).all()
@@ -266,11 +393,15 @@ def update_moderator_info(db: SessionLocal, name: str, new_name: str = None, new
         db_moderator.private_key = new_private_key
     db.commit()
     db.refresh(db_moderator)
+    # Never write private keys to the audit log
+    audit_action(db, "update_moderator", name, None, {"name": db_moderator.name, "private_key_changed": bool(new_private_key)})
     return db_moderator
 
-def get_audit_logs(db: SessionLocal):
-    # Assuming you have an AuditLog model
-    return db.query(AuditLog).all()
+def get_audit_logs(db: SessionLocal, start: datetime = None, end: datetime = None, moderator_name: str = None, action: str = None, limit: int = 100, cursor: str = None):
+    try:
+        return audit.query(db, start, end, moderator_name, action, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 def create_user_report(db: SessionLocal, report: UserReportCreate):
     try:
@@ -284,13 +415,20 @@ def create_user_report(db: SessionLocal, report: UserReportCreate):
         existing_report = db.query(UserReport).filter(UserReport.pubkey == hex_pubkey).first()
         
         if existing_report:
+            aggregate = record_report(db, hex_pubkey, report.reported_by, datetime.utcnow())
+            db.commit()
+            _escalate_after_report(db, aggregate)
+
             # Check if the user is already banned
             existing_pubkey = db.query(PublicKey).filter(PublicKey.pubkey == hex_pubkey).first()
             if existing_pubkey and existing_pubkey.ban_reason:
+                previous_status = existing_report.status
                 existing_report.status = "Handled"
                 existing_report.action_taken = "Already Banned"
                 db.commit()
                 db.refresh(existing_report)
+                stats.cache.report_status_changed(previous_status, existing_report.status)
+                lookups.user_reports.invalidate((hex_pubkey,))
                 return {
                     "id": existing_report.id,
                     "timestamp": existing_report.timestamp,
@@ -322,8 +460,12 @@ def create_user_report(db: SessionLocal, report: UserReportCreate):
             timestamp=datetime.utcnow()
         )
         db.add(new_report)
+        aggregate = record_report(db, hex_pubkey, report.reported_by, new_report.timestamp)
         db.commit()
         db.refresh(new_report)
+        stats.cache.report_status_changed(None, new_report.status)
+        lookups.user_reports.invalidate((hex_pubkey,))
+        _escalate_after_report(db, aggregate)
 
         return {
             "id": new_report.id,
@@ -343,19 +485,34 @@ def create_user_report(db: SessionLocal, report: UserReportCreate):
 def update_user_report(db: SessionLocal, report_update: UserReportUpdate):
     db_report = db.query(UserReport).filter(UserReport.id == report_update.id).first()
     if db_report:
+        before = {"status": db_report.status, "handled_by": db_report.handled_by, "action_taken": db_report.action_taken}
         db_report.status = report_update.status
         db_report.handled_by = report_update.handled_by
         db_report.action_taken = report_update.action_taken
+        # Keep the pubkey's aggregate, and with it the review queue, in step
+        # with its report
+        aggregate = db.query(ReportAggregate).filter(ReportAggregate.pubkey == db_report.pubkey).first()
+        if aggregate is not None:
+            if db_report.status == "Handled":
+                aggregate.status = "Handled"
+            elif aggregate.status == "Handled":
+                # Reopened: back in the review queue if it has enough reporters
+                aggregate.status = "Queued" if report_aggregation.should_queue(aggregate.reporter_count) else "Open"
         db.commit()
         db.refresh(db_report)
+        audit_action(db, "update_report", str(db_report.id), before, {"status": db_report.status, "handled_by": db_report.handled_by, "action_taken": db_report.action_taken})
+        stats.cache.report_status_changed(before["status"], db_report.status)
+        lookups.user_reports.invalidate((db_report.pubkey,))
         return db_report
     raise HTTPException(status_code=404, detail="Report not found")
 
+@lookups.coalesced(lookups.user_reports)
+@use_replica
 def get_user_reports(db: SessionLocal, pubkey: str):
-    return db.query(UserReport).filter(UserReport.pubkey == pubkey).all()
+    return db.execute(select(*serialization.columns(UserReport, schemas.UserReport)).where(UserReport.pubkey == pubkey)).all()
 
 def get_recent_activity(db: SessionLocal):
-    return db.query(AuditLog).order_by(AuditLog.timestamp.desc()).limit(10).all()
+    return audit.query(db, limit=10)["items"]
 
 def approve_report(db: Session, report_data: schemas.ReportApproval):
     report = None
@@ -380,20 +537,114 @@ def approve_report(db: Session, report_data: schemas.ReportApproval):
         db.add(db_pubkey)
 
     # Update report status
+    before = {"status": report.status, "banned": existing_pubkey is not None}
     report.status = "Handled"
     report.handled_by = report_data.moderator_name
     report.action_taken = "Banned"
+    aggregate = db.query(ReportAggregate).filter(ReportAggregate.pubkey == pubkey).first()
+    if aggregate:
+        aggregate.status = "Handled"
     db.commit()
     db.refresh(report)
+    audit_action(db, "approve_report", pubkey, before, {"status": report.status, "report_id": report.id, "ban_reason": report.report_reason})
+    stats.cache.report_status_changed(before["status"], report.status)
+    lookups.user_reports.invalidate((pubkey,))
+    if not existing_pubkey:
+        stats.cache.ban_added(db_pubkey.timestamp)
+        changes.publish("pubkeys", added=[pubkey])
     return report
 
+@use_replica
 def get_pending_reports(db: SessionLocal):
-    return db.query(UserReport).filter(UserReport.status == "Pending").all()
+    return db.execute(select(*serialization.columns(UserReport, schemas.UserReport)).where(UserReport.status == "Pending")).all()
 
+@use_replica
 def get_all_reports(db: SessionLocal):
-    return db.query(UserReport).all()
+    return db.execute(select(*serialization.columns(UserReport, schemas.UserReport))).all()
 
+@use_replica
 def get_successful_reports(db: SessionLocal):
-    return db.query(UserReport).filter(UserReport.status == "Approved").all()
+    return db.execute(select(*serialization.columns(UserReport, schemas.UserReport)).where(UserReport.status == "Approved")).all()
+
+def record_report(db: SessionLocal, pubkey: str, reported_by: str | None, timestamp: datetime):
+    # Fold a single report into the pubkey's aggregate. The caller commits.
+    # Upserts like _upsert_temp_ban, so concurrent first reports of a key
+    # neither hit the unique constraints nor lose a count. The aggregate row
+    # stays locked by this transaction until the caller commits.
+    dialect = db.get_bind().dialect.name
+    insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+    statement = insert(ReportAggregate).values(pubkey=pubkey, reporter_count=0, report_count=1, first_report_at=timestamp, last_report_at=timestamp, status="Open")
+    statement = statement.on_conflict_do_update(
+        index_elements=[ReportAggregate.pubkey],
+        set_={"report_count": ReportAggregate.report_count + 1, "last_report_at": statement.excluded.last_report_at}
+    ).returning(ReportAggregate.id)
+    aggregate = db.get(ReportAggregate, db.execute(statement).scalar_one(), populate_existing=True)
+
+    # Only the first report from each known reporter counts towards the score,
+    # anonymous and repeated reports just update the timestamps
+    if reported_by:
+        statement = insert(ReportReporter).values(pubkey=pubkey, reported_by=reported_by, timestamp=timestamp)
+        statement = statement.on_conflict_do_nothing(index_elements=[ReportReporter.pubkey, ReportReporter.reported_by]).returning(ReportReporter.id)
+        if db.execute(statement).first() is not None:
+            aggregate.reporter_count += 1
+            aggregate.score_key = report_aggregation.add_to_score_key(aggregate.score_key, timestamp)
+    return aggregate
+
+def _escalate_after_report(db: SessionLocal, aggregate: ReportAggregate):
+    # The report is already committed, so a failed escalation must not turn
+    # it into an error; the next report of the key tries again
+    pubkey = aggregate.pubkey
+    try:
+        escalate_reported_pubkey(db, aggregate)
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Error escalating reported pubkey {pubkey}: {e}")
+
+def escalate_reported_pubkey(db: SessionLocal, aggregate: ReportAggregate):
+    # A temp-banned pubkey is looked at again once its automatic ban has run
+    # out (or was lifted), so a repeat offender is banned or queued again
+    if aggregate.status == "TempBanned":
+        if db.query(TempBan.id).filter(TempBan.pubkey == aggregate.pubkey, TempBan.expiry_timestamp > datetime.utcnow()).first():
+            return
+    elif aggregate.status not in ("Open", "Queued"):
+        return
+
+    previous_status = aggregate.status
+    score = report_aggregation.current_score(aggregate.score_key)
+    if report_aggregation.should_temp_ban(aggregate.reporter_count, score):
+        logging.info(f"Auto temp-banning {aggregate.pubkey}: {aggregate.reporter_count} reporters, score {score:.2f}")
+        temp_ban_pubkey(db, TempBanCreate(pubkey=aggregate.pubkey, duration=report_aggregation.REPORT_AUTO_TEMP_BAN_DURATION))
+        aggregate.status = "TempBanned"
+        db.commit()
+    elif previous_status != "Queued" and report_aggregation.should_queue(aggregate.reporter_count):
+        aggregate.status = "Queued"
+        db.commit()
+        audit.record("queue_reported_pubkey", "system", aggregate.pubkey, {"status": previous_status}, {"status": "Queued", "reporter_count": aggregate.reporter_count})
+    elif previous_status == "TempBanned":
+        aggregate.status = "Open"
+        db.commit()
+
+@use_replica
+def get_report_queue(db: SessionLocal, limit: int = 50):
+    aggregates = (
+        db.query(ReportAggregate)
+        .filter(ReportAggregate.status != "Handled")
+        .order_by(ReportAggregate.score_key.desc().nullslast(), ReportAggregate.last_report_at.desc())
+        .limit(limit)
+        .all()
+    )
+    now = datetime.utcnow()
+    return [
+        {
+            "pubkey": aggregate.pubkey,
+            "reporter_count": aggregate.reporter_count,
+            "report_count": aggregate.report_count,
+            "score": report_aggregation.current_score(aggregate.score_key, now),
+            "first_report_at": aggregate.first_report_at,
+            "last_report_at": aggregate.last_report_at,
+            "status": aggregate.status
+        }
+        for aggregate in aggregates
+    ]
 
 # ... other CRUD operations ... 
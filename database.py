@@ -1,9 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
+import fcntl
+import functools
+import itertools
+import logging
 import os
 import subprocess
+import threading
+import time
 import models
 
 # Load environment variables from .env file
@@ -19,10 +26,88 @@ if POSTGRES_URL:
 else:
     SQLALCHEMY_DATABASE_URL = SQLITE_URL
 
+# Optional read replicas, comma separated
+READ_REPLICA_URLS = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_RETRY_INTERVAL = float(os.getenv("REPLICA_RETRY_INTERVAL", 30))  # seconds a failed replica is skipped
+
+def _connect_args(url: str) -> dict:
+    return {"check_same_thread": False} if "sqlite" in url else {}
+
 # Create the engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {})
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=_connect_args(SQLALCHEMY_DATABASE_URL))
+
+# Read replica routing.
+#
+# Read-only crud functions are wrapped with @use_replica. While one of them
+# runs, RoutingSession sends its queries to a replica picked round-robin from
+# the healthy ones. Everything else, and every read in a session that has
+# already written (for read-your-writes within a request), goes to the
+# primary. A replica whose connection fails is skipped for
+# REPLICA_RETRY_INTERVAL seconds and the function is retried on the primary;
+# after that the next query routed to it doubles as the health check.
+
+class ReplicaSet:
+    def __init__(self, engines: list, retry_interval: float):
+        self.engines = engines
+        self.retry_interval = retry_interval
+        self._down_until = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.engines)):
+                replica = self.engines[next(self._counter) % len(self.engines)]
+                if self._down_until.get(replica, 0) <= now:
+                    return replica
+        return None
+
+    def mark_down(self, replica, error: Exception):
+        with self._lock:
+            self._down_until[replica] = time.monotonic() + self.retry_interval
+        logging.warning(f"Read replica {replica.url.render_as_string(hide_password=True)} failed, using the primary for {self.retry_interval:.0f}s: {error}")
+
+    def healthy(self) -> int:
+        now = time.monotonic()
+        return sum(1 for replica in self.engines if self._down_until.get(replica, 0) <= now)
+
+replicas = ReplicaSet([create_engine(url, connect_args=_connect_args(url), pool_pre_ping=True) for url in READ_REPLICA_URLS], REPLICA_RETRY_INTERVAL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or (clause is not None and getattr(clause, "is_dml", False)):
+            self.info["wrote"] = True
+        replica = self.info.get("replica")
+        if replica is not None and not self.info.get("wrote"):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+def use_replica(function):
+    @functools.wraps(function)
+    def wrapper(db, *args, **kwargs):
+        # Nested calls keep the replica chosen by the outermost one
+        if not replicas.engines or db.info.get("wrote") or "replica" in db.info:
+            return function(db, *args, **kwargs)
+        replica = replicas.choose()
+        if replica is None:
+            return function(db, *args, **kwargs)
+
+        db.info["replica"] = replica
+        try:
+            return function(db, *args, **kwargs)
+        except DBAPIError as e:
+            if not isinstance(e, (OperationalError, InterfaceError)) and not e.connection_invalidated:
+                raise
+            replicas.mark_down(replica, e)
+            db.rollback()
+            del db.info["replica"]
+            return function(db, *args, **kwargs)
+        finally:
+            db.info.pop("replica", None)
+    return wrapper
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
@@ -33,13 +118,51 @@ def backup_sqlite():
         subprocess.run(["cp", SQLITE_URL.split("///")[-1], backup_file])
         print(f"Backup created: {backup_file}")
 
+# Migrations are applied once with `alembic upgrade head` (see alembic.ini),
+# not by every worker. On startup each worker only compares the revision in
+# alembic_version with the newest migration and refuses to start on a
+# mismatch. With AUTO_MIGRATE the worker upgrades the database itself, which
+# is the default for SQLite. Workers started together take an exclusive flock
+# on MIGRATE_LOCK_PATH first, so one of them migrates and the others find the
+# schema up to date once they get the lock.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "True" if "sqlite" in SQLALCHEMY_DATABASE_URL else "False").lower() == "true"
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+MIGRATE_LOCK_PATH = (engine.url.database if engine.url.get_backend_name() == "sqlite" and engine.url.database else ALEMBIC_INI) + ".migrate.lock"
+
+def _alembic_config():
+    from alembic.config import Config
+    config = Config(ALEMBIC_INI)
+    # Keep the application's logging setup when migrating from a worker
+    config.attributes["configure_logger"] = False
+    return config
+
+def schema_revision() -> str | None:
+    with engine.connect() as connection:
+        if not inspect(connection).has_table("alembic_version"):
+            return None
+        return connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+def head_revision() -> str:
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory.from_config(_alembic_config()).get_current_head()
+
 # Function to migrate database
 def migrate_database():
-    # Use Alembic or another migration tool to handle migrations
-    # Example: subprocess.run(["alembic", "upgrade", "head"])
-    try:
-        # Check if tables exist and create them if they don't
-        models.Base.metadata.create_all(bind=engine)
-        print("Database initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing database: {e}") 
+    current, head = schema_revision(), head_revision()
+    if current == head:
+        return
+    if not AUTO_MIGRATE:
+        raise RuntimeError(f"Database schema is at revision {current or 'none'} but the code expects {head}. Run `alembic upgrade head` before starting the API.")
+
+    from alembic import command
+    with open(MIGRATE_LOCK_PATH, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Another worker may have migrated while this one waited for the lock
+            current = schema_revision()
+            if current == head:
+                return
+            command.upgrade(_alembic_config(), "head")
+            print(f"Database migrated from revision {current or 'none'} to {head}.")
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
@@ -1,6 +1,7 @@
-from fastapi import Header, HTTPException, Depends
+from fastapi import Header, HTTPException, Depends, Request
 from sqlalchemy.orm import Session
 from database import SessionLocal
+import hmac
 import os
 import logging
 from dotenv import load_dotenv
@@ -15,29 +16,49 @@ def get_db():
     finally:
         db.close()
 
-def get_api_key(x_api_key: str = Header(...), admin_only: bool = False):
-    admin_key = os.getenv("ADMIN_API_KEY")
-    moderator_keys = os.getenv("MODERATOR_KEYS", "")
-    moderator_dict = dict(item.split(":") for item in moderator_keys.split(",") if item)
+# API keys are resolved to a moderator once, not on every request
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+# Lets a Prometheus scraper read /metrics without the admin key
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+MODERATORS = {key: name for name, key in (item.split(":", 1) for item in os.getenv("MODERATOR_KEYS", "").split(",") if item)}
 
-    logging.info(f"Received x-api-key: {x_api_key}")
-    logging.info(f"Expected ADMIN_API_KEY: {admin_key}")
+def moderator_for_key(api_key: str | None) -> str | None:
+    # "admin" for the admin key, the moderator's name for a moderator key
+    if not api_key:
+        return None
+    if ADMIN_API_KEY and api_key == ADMIN_API_KEY:
+        return "admin"
+    return MODERATORS.get(api_key)
+
+def get_api_key(request: Request, x_api_key: str = Header(...), admin_only: bool = False, db: Session = Depends(get_db)):
+    moderator_name = moderator_for_key(x_api_key)
 
     # Allow admin key for all endpoints
-    if x_api_key == admin_key:
+    if ADMIN_API_KEY and x_api_key == ADMIN_API_KEY:
         logging.info("Admin key matched successfully.")
-        return True
-
     # If the endpoint is admin-only and the key is not the admin key, deny access
-    if admin_only:
+    elif admin_only:
         logging.warning("Admin-only access attempted with invalid key.")
         raise HTTPException(status_code=403, detail="Invalid API key for admin access")
-
-    # Check if the key is a valid moderator key
-    if x_api_key in moderator_dict.values():
+    elif moderator_name is None:
+        logging.warning("Invalid API key provided.")
+        raise HTTPException(status_code=403, detail="Invalid API key")
+    else:
         logging.info("Moderator key matched successfully.")
-        return True
 
-    logging.warning("Invalid API key provided.")
-    raise HTTPException(status_code=403, detail="Invalid API key")
+    # Attribute the request and its audit log entries to the caller
+    request.state.moderator = moderator_name
+    db.info["moderator_name"] = moderator_name
+    return True
+
+def get_admin_api_key(request: Request, x_api_key: str = Header(...), db: Session = Depends(get_db)):
+    return get_api_key(request, x_api_key, admin_only=True, db=db)
 
+def get_metrics_access(authorization: str | None = Header(None), x_api_key: str | None = Header(None)):
+    # /metrics names moderators, so it takes METRICS_TOKEN as a bearer token or the admin key
+    if METRICS_TOKEN and authorization and hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}"):
+        return True
+    if ADMIN_API_KEY and x_api_key and hmac.compare_digest(x_api_key, ADMIN_API_KEY):
+        return True
+    logging.warning("Metrics access attempted without a valid token.")
+    raise HTTPException(status_code=403, detail="Invalid metrics token")
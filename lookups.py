@@ -0,0 +1,137 @@
+from dotenv import load_dotenv
+from collections import OrderedDict
+import functools
+import os
+import threading
+import time
+import changes
+import metrics
+
+# Request coalescing for the hot read paths.
+#
+# When many clients ask about the same key at once, only the first request
+# (the leader) runs the query; requests for the same key that arrive while it
+# is in flight wait for it and share its result or exception. The result is
+# then served from memory for LOOKUP_CACHE_TTL seconds, so a burst of
+# identical lookups costs about one query per key.
+#
+# Invalidating a key also detaches the in-flight query for it: callers that
+# arrive afterwards start a new one, and a result that was being loaded while
+# the cache was invalidated is returned to its waiters but not cached. Ban
+# changes invalidate the status lookups through changes.py, including changes
+# made by other workers. Report changes are invalidated by crud.py in this
+# worker only; other workers see them after at most LOOKUP_CACHE_TTL seconds.
+#
+# Every lookup is counted in cache_requests_total under the lookup's metric
+# name; a caller that shares an in-flight query counts as a hit, since it
+# costs no query of its own.
+
+load_dotenv()
+
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", 1.0))  # seconds, 0 disables the cache but keeps coalescing
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 10000))  # entries per lookup
+
+class _Call:
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, name: str, metric_name: str, ttl: float, max_entries: int):
+        self.name = name
+        self.metric_name = metric_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            cached = entry is not None and entry[0] > time.monotonic()
+            if cached:
+                self.hits += 1
+            else:
+                call = self._inflight.get(key)
+                leader = call is None
+                if leader:
+                    call = self._inflight[key] = _Call(self._generation)
+                    self.misses += 1
+                else:
+                    self.shared += 1
+        metrics.record_cache(self.metric_name, cached or not leader)
+
+        if cached:
+            return entry[1]
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+                if call.error is None and self.ttl > 0 and call.generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, call.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            call.done.set()
+        return call.value
+
+    def invalidate(self, key=None):
+        # Without a key, everything is invalidated
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+                self._inflight.clear()
+            else:
+                self._entries.pop(key, None)
+                self._inflight.pop(key, None)
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared
+        }
+
+def coalesced(lookup: SingleFlight):
+    # For crud functions called as function(db, *args); the arguments are the key
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(db, *args):
+            # A session that has written reads its own writes from the database
+            if db.info.get("wrote"):
+                return function(db, *args)
+            return lookup.get(args, lambda: function(db, *args))
+        return wrapper
+    return decorator
+
+pubkey_status = SingleFlight("pubkey_status", "status", LOOKUP_CACHE_TTL, LOOKUP_CACHE_SIZE)
+user_reports = SingleFlight("user_reports", "reports", LOOKUP_CACHE_TTL, LOOKUP_CACHE_SIZE)
+
+# Status lookups are keyed by the pubkey as given, hex or npub, so any ban
+# change invalidates all of them
+changes.subscribe("pubkeys", lambda added, removed: pubkey_status.invalidate())
+changes.subscribe("temp_bans", lambda added, removed: pubkey_status.invalidate())
+
+def status() -> dict:
+    return {lookup.name: lookup.status() for lookup in (pubkey_status, user_reports)}
@@ -1,13 +1,14 @@
 import os
 import uvicorn
 from fastapi import FastAPI, HTTPException, Depends, Request, Body, Header
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import models, crud, schemas, database, utils
+import models, crud, schemas, database, utils, audit, stats, metrics, profiling, capture, serialization, blocklist, bloom, changes, lookups, nostr_lists, pubkey_set, write_queue
 from database import engine, SessionLocal, migrate_database, backup_sqlite
 from dotenv import load_dotenv
-from dependencies import get_api_key
+from dependencies import get_api_key, get_admin_api_key, get_metrics_access, get_db
 from rate_limit import RateLimitMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from datetime import datetime
@@ -21,48 +22,51 @@ logging.basicConfig(level=logging.DEBUG if debug_mode else logging.INFO)
 
 app = FastAPI(title="Azzamo Banlist API")
 
-# Add rate limiting middleware with ban duration
+# Per-moderator write quotas and fair-share write scheduling
+app.add_middleware(write_queue.WriteSchedulerMiddleware)
+
+# Add rate limiting middleware with ban duration. Added after the write
+# scheduler so it runs before it, and rate limited clients never queue.
 app.add_middleware(
     RateLimitMiddleware,
     rate_limit=int(os.getenv("RATE_LIMIT", 100)),
     ban_duration=int(os.getenv("RATE_LIMIT_BAN_DURATION", 1260))
 )
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
-
-# Ensure the lists directory and files are present
-utils.ensure_lists_directory_and_files()
+# Request and query metrics for /metrics
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine)
+    for replica in database.replicas.engines:
+        metrics.instrument_engine(replica)
+    metrics.register_replicas(database.replicas)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Sampled, anonymized traffic capture for benchmarks/replay.py
+if capture.CAPTURE_ENABLED:
+    app.add_middleware(capture.CaptureMiddleware)
 
 # Public Endpoints
 @app.get("/blocked/pubkeys", response_model=list[schemas.PublicKey], summary="Get Blocked Public Keys", description="Retrieve a list of all blocked public keys.", tags=["Core"])
 async def get_blocked_pubkeys(db: Session = Depends(get_db)):
     try:
-        return crud.get_blocked_pubkeys(db)
+        return serialization.rows_response(crud.get_blocked_pubkeys(db), schemas.PublicKey)
     except Exception as e:
         logging.error(f"Error retrieving blocked public keys: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/blocked/words", response_model=list[schemas.Word], summary="Get Blocked Words", description="Retrieve a list of all blocked words.", tags=["Core"])
 async def get_blocked_words(db: Session = Depends(get_db)):
-    words = crud.get_blocked_words(db)
-    return [{"id": word.id, "word": word.word, "timestamp": word.timestamp.isoformat()} for word in words]
+    return serialization.rows_response(crud.get_blocked_words(db), schemas.Word)
 
 @app.get("/blocked/ips", response_model=list[schemas.IPAddress], dependencies=[Depends(get_api_key)], summary="Get Blocked IPs", description="Retrieve a list of all blocked IP addresses.", tags=["Core"])
 async def get_blocked_ips(db: Session = Depends(get_db)):
-    return crud.get_blocked_ips(db)
+    return serialization.rows_response(crud.get_blocked_ips(db), schemas.IPAddress)
 
 @app.get("/blocked/pubkeys/status", summary="Check Public Key Status", description="Check if a public key is blocked and if it is temporarily banned.")
 async def check_pubkey_status(pubkey: str, db: Session = Depends(get_db), api_key: str = Header(None)):
-    status_info = crud.check_pubkey_status(db, pubkey)
+    # The lookup runs in the threadpool so concurrent identical requests can
+    # share it (see lookups.py); the result is shared, so copy it before adding to it
+    status_info = dict(await run_in_threadpool(crud.check_pubkey_status, db, pubkey))
     
     # If an API key is provided, include the moderator information
     if api_key:
@@ -87,6 +91,10 @@ async def remove_blocked_pubkey(pubkey: schemas.PublicKeyCreate, db: Session = D
 async def temp_ban_pubkey(pubkey: schemas.TempBanCreate, db: Session = Depends(get_db)):
     return crud.temp_ban_pubkey(db, pubkey)
 
+@app.post("/temp-ban/pubkeys/batch", dependencies=[Depends(get_api_key)], summary="Temporarily Ban Public Keys", description="Temporarily ban or extend the bans of up to 1000 public keys in one transaction. Active bans are extended from their current expiry, expired ones start over.", tags=["Moderator Operations"])
+async def temp_ban_pubkeys(batch: schemas.TempBanBatch, db: Session = Depends(get_db)):
+    return crud.temp_ban_pubkeys(db, batch.bans)
+
 @app.delete("/temp-ban/pubkeys", dependencies=[Depends(get_api_key)], summary="Remove Temporary Ban", description="Remove a temporary ban on a public key.")
 async def remove_temp_ban(pubkey: schemas.PublicKeyCreate, db: Session = Depends(get_db)):
     crud.remove_temp_ban(db, pubkey)
@@ -138,10 +146,58 @@ async def update_ban_reason(
 async def remove_ban_reason(pubkey: str, db: Session = Depends(get_db)):
     return crud.remove_ban_reason(db, pubkey)
 
-@app.get("/public/blocked/pubkeys", summary="Get Public List of Blocked Public Keys", description="Retrieve a public list of all blocked public keys.", tags=["Public"])
-async def get_public_blocked_pubkeys(db: Session = Depends(get_db)):
-    blocked_pubkeys = crud.get_blocked_pubkeys(db)
-    return [pubkey.pubkey for pubkey in blocked_pubkeys]
+@app.get(
+    "/public/blocked/pubkeys",
+    response_model=list[str],
+    responses={200: {"content": {blocklist.MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}}}},
+    summary="Get Public List of Blocked Public Keys",
+    description=f"Retrieve a public list of all blocked public keys. Send `Accept: {blocklist.MEDIA_TYPE}` (or `application/octet-stream`) to get the compact binary format: a 24-byte header followed by the sorted raw 32-byte keys.",
+    tags=["Public"]
+)
+async def get_public_blocked_pubkeys(request: Request, db: Session = Depends(get_db)):
+    if blocklist.wants_binary(request.headers.get("accept")):
+        data, etag = await run_in_threadpool(blocklist.pubkeys.get)
+        headers = {"ETag": etag, "Vary": "Accept"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(data, media_type=blocklist.MEDIA_TYPE, headers=headers)
+    return serialization.FastJSONResponse(crud.get_public_blocked_pubkeys(db), headers={"Vary": "Accept"})
+
+@app.get(
+    "/public/blocked/pubkeys/filter",
+    response_class=Response,
+    responses={200: {"content": {bloom.MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}}}},
+    summary="Get Blocked Public Key Filter",
+    description="Download a Bloom filter over the blocked and temporarily banned public keys. A miss means the key is not banned; only hits need a call to `/blocked/pubkeys/status`. Poll with `If-None-Match` to get a 304 when the filter has not changed.",
+    tags=["Public"]
+)
+async def get_blocked_pubkey_filter(request: Request):
+    # The first build reads every ban, so keep it off the event loop
+    data, etag = await run_in_threadpool(bloom.ban_filter.get)
+    headers = {"ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(data, media_type=bloom.MEDIA_TYPE, headers=headers)
+
+@app.get("/public/blocked/pubkeys/filter/info", summary="Get Blocked Public Key Filter Info", description="Show the size, hash count, generation and estimated false positive rate of the current Bloom filter.", tags=["Public"])
+async def get_blocked_pubkey_filter_info():
+    return bloom.ban_filter.status()
+
+@app.get("/public/nostr/lists", summary="Get Nostr Ban Lists", description="Download the blocked public keys and words as signed NIP-51 list events (kind 30000), one per chunk of the list. Pass `since` (unix seconds) to get only the chunks that changed since then. Poll with `If-None-Match` to get a 304 when nothing changed.", tags=["Public"])
+async def get_nostr_lists(request: Request, since: int | None = None):
+    if not nostr_lists.publisher.enabled:
+        raise HTTPException(status_code=404, detail="Nostr list publishing is not configured")
+    # Signing changed chunks can take a while, so keep it off the event loop
+    events, body, etag = await run_in_threadpool(nostr_lists.publisher.get)
+    if since is not None:
+        return serialization.FastJSONResponse([event for event in events if event["created_at"] >= since])
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/public/nostr/lists/info", summary="Get Nostr Ban Lists Info", description="Show the signing public key, the number of list events and how many were signed or reused from the cache.", tags=["Public"])
+async def get_nostr_lists_info():
+    return nostr_lists.publisher.status()
 
 @app.post("/blacklist/words", dependencies=[Depends(get_api_key)], summary="Add Blacklisted Word", description="Add a new word or sentence to the blacklist.", tags=["Word Blacklisting"])
 async def add_blacklisted_word(word_data: schemas.WordCreate, db: Session = Depends(get_db)):
@@ -167,25 +223,24 @@ async def add_blocked_ip(ip_data: dict = Body(...), db: Session = Depends(get_db
 async def remove_blocked_ip(ip: str, db: Session = Depends(get_db)):
     return crud.remove_blocked_ip(db, ip)
 
-@app.get("/public/blocked/words", summary="Get Public List of Blocked Words", description="Retrieve a public list of all blocked words.", tags=["Public"])
+@app.get("/public/blocked/words", response_model=list[str], summary="Get Public List of Blocked Words", description="Retrieve a public list of all blocked words.", tags=["Public"])
 async def get_public_blocked_words(db: Session = Depends(get_db)):
-    blocked_words = crud.get_blocked_words(db)
-    return [word.word for word in blocked_words]
+    return serialization.FastJSONResponse(crud.get_public_blocked_words(db))
 
 # Moderator Management
-# @app.post("/moderators", dependencies=[Depends(lambda: get_api_key(admin_only=True))], summary="Add Moderator (Admin Only)", description="Add a new moderator. Requires admin API key.", tags=["Moderator Management"])
+# @app.post("/moderators", dependencies=[Depends(get_admin_api_key)], summary="Add Moderator (Admin Only)", description="Add a new moderator. Requires admin API key.", tags=["Moderator Management"])
 # async def add_moderator(moderator: schemas.ModeratorCreate, db: Session = Depends(get_db)):
 #     return crud.add_moderator(db, moderator.name, moderator.private_key)
 
-# @app.delete("/moderators", dependencies=[Depends(lambda: get_api_key(admin_only=True))], summary="Remove Moderator (Admin Only)", description="Remove a moderator. Requires admin API key.", tags=["Moderator Management"])
+# @app.delete("/moderators", dependencies=[Depends(get_admin_api_key)], summary="Remove Moderator (Admin Only)", description="Remove a moderator. Requires admin API key.", tags=["Moderator Management"])
 # async def remove_moderator(moderator: schemas.ModeratorDelete, db: Session = Depends(get_db)):
 #     return crud.remove_moderator(db, moderator.name)
 
-# @app.get("/moderators", dependencies=[Depends(lambda: get_api_key(admin_only=True))], summary="List Moderators (Admin Only)", description="List all moderators. Requires admin API key.", tags=["Moderator Management"])
+# @app.get("/moderators", dependencies=[Depends(get_admin_api_key)], summary="List Moderators (Admin Only)", description="List all moderators. Requires admin API key.", tags=["Moderator Management"])
 # async def list_moderators(db: Session = Depends(get_db)):
 #     return crud.list_moderators(db)
 
-# @app.patch("/moderators", dependencies=[Depends(lambda: get_api_key(admin_only=True))], summary="Update Moderator Information (Admin Only)", description="Update the name or private key of an existing moderator. Requires admin API key.", tags=["Moderator Management"])
+# @app.patch("/moderators", dependencies=[Depends(get_admin_api_key)], summary="Update Moderator Information (Admin Only)", description="Update the name or private key of an existing moderator. Requires admin API key.", tags=["Moderator Management"])
 # async def update_moderator_info(moderator: schemas.ModeratorUpdate, db: Session = Depends(get_db)):
 #     return crud.update_moderator_info(db, moderator.name, moderator.new_name, moderator.new_private_key)
 
@@ -223,9 +278,17 @@ async def get_statistics(db: Session = Depends(get_db)):
 async def get_expiring_temp_bans(hours: int, db: Session = Depends(get_db)):
     return crud.get_expiring_temp_bans(db, hours)
 
-@app.get("/audit-logs", dependencies=[Depends(get_api_key)], summary="Audit Logs", description="Retrieve logs of all actions performed by moderators.", tags=["Audit Logs"])
-async def get_audit_logs(db: Session = Depends(get_db)):
-    return crud.get_audit_logs(db)
+@app.get("/audit-logs", dependencies=[Depends(get_api_key)], response_model=schemas.AuditLogPage, summary="Audit Logs", description="Retrieve logs of actions performed by moderators, newest first. Pass `next_cursor` back as `cursor` to fetch the next page.", tags=["Audit Logs"])
+async def get_audit_logs(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    moderator: str | None = None,
+    action: str | None = None,
+    limit: int = 100,
+    cursor: str | None = None,
+    db: Session = Depends(get_db)
+):
+    return crud.get_audit_logs(db, start, end, moderator, action, min(max(limit, 1), 1000), cursor)
 
 @app.post("/reports", response_model=schemas.UserReport, summary="Create User Report", description="Create a new user report.")
 async def create_user_report(report: schemas.UserReportCreate, db: Session = Depends(get_db)):
@@ -238,11 +301,11 @@ async def create_user_report(report: schemas.UserReportCreate, db: Session = Dep
 async def update_report(report_update: schemas.UserReportUpdate, db: Session = Depends(get_db)):
     return crud.update_user_report(db, report_update)
 
-@app.get("/reports/{pubkey}", response_model=list[schemas.UserReport], summary="Get User Reports", description="Retrieve reports for a specific public key.", tags=["User Reports"])
-async def get_reports(pubkey: str, db: Session = Depends(get_db)):
-    return crud.get_user_reports(db, pubkey)
+@app.get("/reports/queue", dependencies=[Depends(get_api_key)], response_model=list[schemas.ReportAggregate], summary="Get Report Queue", description="Retrieve reported public keys ranked by their time-decayed report score.", tags=["User Reports"])
+async def get_report_queue(limit: int = 50, db: Session = Depends(get_db)):
+    return crud.get_report_queue(db, min(max(limit, 1), 500))
 
-@app.get("/recent-activity", dependencies=[Depends(lambda: get_api_key(admin_only=True))], response_model=list[schemas.AuditLog], summary="Get Recent Activity", description="Retrieve recent actions performed by moderators.")
+@app.get("/recent-activity", dependencies=[Depends(get_admin_api_key)], response_model=list[schemas.AuditLog], summary="Get Recent Activity", description="Retrieve recent actions performed by moderators.")
 async def recent_activity(db: Session = Depends(get_db)):
     return crud.get_recent_activity(db)
 
@@ -257,17 +320,60 @@ async def approve_report(
 # Public endpoint to get pending reports
 @app.get("/reports/pending", response_model=list[schemas.UserReport], summary="Get Pending Reports", description="Retrieve all pending user reports.", tags=["User Reports"])
 async def get_pending_reports(db: Session = Depends(get_db)):
-    return crud.get_pending_reports(db)
+    return serialization.rows_response(crud.get_pending_reports(db), schemas.UserReport)
 
 # Public endpoint to get all reports
 @app.get("/reports/all", response_model=list[schemas.UserReport], summary="Get All Reports", description="Retrieve all user reports.", tags=["Core"])
 async def get_all_reports(db: Session = Depends(get_db)):
-    return crud.get_all_reports(db)
+    return serialization.rows_response(crud.get_all_reports(db), schemas.UserReport)
 
 # Public endpoint to get successful reports
 @app.get("/reports/successful", response_model=list[schemas.UserReport], summary="Get Successful Reports", description="Retrieve all successfully reported and banned users.", tags=["Core"])
 async def get_successful_reports(db: Session = Depends(get_db)):
-    return crud.get_successful_reports(db)
+    return serialization.rows_response(crud.get_successful_reports(db), schemas.UserReport)
+
+# Declared after the fixed /reports/... paths so it does not shadow them
+@app.get("/reports/{pubkey}", response_model=list[schemas.UserReport], summary="Get User Reports", description="Retrieve reports for a specific public key.", tags=["User Reports"])
+async def get_reports(pubkey: str, db: Session = Depends(get_db)):
+    return serialization.rows_response(await run_in_threadpool(crud.get_user_reports, db, pubkey), schemas.UserReport)
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(get_metrics_access)], include_in_schema=False)
+async def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Profiling (Admin Only)
+@app.get("/admin/profiling", dependencies=[Depends(get_admin_api_key)], summary="Get Profiling Status (Admin Only)", description="Show whether the sampling profiler and slow query tracing are enabled in this worker.", tags=["Profiling"])
+async def get_profiling_status():
+    return profiling.status()
+
+@app.get("/admin/changes", dependencies=[Depends(get_admin_api_key)], summary="Get Change Feed Status (Admin Only)", description="Show this worker's node id and how many ban list changes it has broadcast and received from other workers.", tags=["Profiling"])
+async def get_change_feed_status():
+    return changes.status()
+
+@app.get("/admin/writes", dependencies=[Depends(get_admin_api_key)], summary="Get Write Queue Status (Admin Only)", description="Show the writes running and queued per moderator in this worker, the public writes per client IP, and each moderator's remaining write tokens.", tags=["Profiling"])
+async def get_write_queue_status():
+    return write_queue.status()
+
+@app.get("/admin/lookups", dependencies=[Depends(get_admin_api_key)], summary="Get Lookup Cache Status (Admin Only)", description="Show how many status and report lookups in this worker were served from the cache, shared with a concurrent identical request, or queried, and the state of the packed pubkey set.", tags=["Profiling"])
+async def get_lookup_status():
+    return {**lookups.status(), "pubkey_set": pubkey_set.banned.status()}
+
+@app.post("/admin/profiling", dependencies=[Depends(get_admin_api_key)], summary="Configure Profiling (Admin Only)", description="Enable or disable the sampling profiler and slow query tracing in this worker. Omitted settings are left unchanged.", tags=["Profiling"])
+async def configure_profiling(settings: schemas.ProfilingSettings):
+    return profiling.configure(settings.sampling, settings.sample_interval_ms, settings.slow_queries, settings.slow_query_ms)
+
+@app.get("/admin/profiling/stacks", dependencies=[Depends(get_admin_api_key)], response_class=PlainTextResponse, summary="Get Sampled Stacks (Admin Only)", description="Download the sampled stacks in collapsed format for flamegraph.pl or speedscope.", tags=["Profiling"])
+async def get_profiling_stacks(reset: bool = False):
+    stacks = profiling.profiler.collapsed()
+    if reset:
+        profiling.profiler.reset()
+    return PlainTextResponse(stacks)
+
+@app.get("/admin/profiling/slow-queries", dependencies=[Depends(get_admin_api_key)], summary="Get Slow Queries (Admin Only)", description="Retrieve the most recent queries that exceeded the slow query threshold, with their parameters and query plan.", tags=["Profiling"])
+async def get_slow_queries():
+    return list(profiling.slow_queries.recent)
 
 @app.get("/test-admin-simple", dependencies=[Depends(get_api_key)])
 async def test_admin_simple():
@@ -304,11 +410,24 @@ async def remove_temp_ban(pubkey: schemas.PublicKeyCreate, db: Session = Depends
 
 @app.on_event("startup")
 async def startup_event():
-    # Migrate the database
+    # Check the schema version; migrations are run with `alembic upgrade head`
     migrate_database()
 
+    # Follow ban list changes made by the other workers
+    changes.feed.start()
+
+    # Ensure the lists directory and files are present
+    utils.ensure_lists_directory_and_files()
+
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Write out any buffered audit log entries and counter changes
+    audit.writer.stop()
+    stats.cache.stop()
+    profiling.stop()
+    capture.stop()
+    changes.stop()
+
     # Backup the SQLite database
     backup_sqlite()
 
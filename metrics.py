@@ -0,0 +1,243 @@
+from sqlalchemy import event
+from dotenv import load_dotenv
+from collections import defaultdict
+from bisect import bisect_left
+from time import perf_counter
+import os
+import sys
+import threading
+
+# Minimal Prometheus text-format metrics.
+#
+# Everything is kept in plain dicts keyed by label tuples and only formatted
+# when /metrics is scraped, so recording a sample costs a lock and a couple of
+# dict operations. Route latency is recorded by MetricsMiddleware (a raw ASGI
+# middleware, so it adds no extra task or response copy), query counts and
+# durations by SQLAlchemy cursor events, attributed to the innermost crud.py
+# function on the stack.
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = defaultdict(float)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self.values[labels] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+class Gauge:
+    # Gauges are read from a callback at scrape time, returning {labels: value}
+    def __init__(self, name: str, documentation: str, callback, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.callback().items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self.values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            data[0][index] += 1
+            data[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += counts[-1]
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# HTTP
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route on the scope; labelling by the
+            # route template keeps cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe((method, path), perf_counter() - start)
+            http_requests.inc((method, path, status))
+
+# Database
+
+db_queries = Counter("db_queries_total", "Database queries by crud.py function.", ("function",))
+db_query_duration = Histogram("db_query_duration_seconds", "Database query time by crud.py function.", ("function",))
+db_pool_checkout_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.")
+
+def _crud_function() -> str:
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == "crud":
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "other"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    function = _crud_function()
+    db_query_duration.observe((function,), perf_counter() - started)
+    db_queries.inc((function,))
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    # SQLAlchemy has no event before a checkout starts, so time the pool's
+    # connect() itself
+    pool = engine.pool
+    checkout = pool.connect
+
+    def timed_checkout():
+        start = perf_counter()
+        try:
+            return checkout()
+        finally:
+            db_pool_checkout_wait.observe((), perf_counter() - start)
+
+    pool.connect = timed_checkout
+
+_replica_sets = []
+
+def register_replicas(replicas):
+    _replica_sets.append(replicas)
+
+Gauge("db_replicas", "Configured read replicas.", lambda: {(): sum(len(replicas.engines) for replicas in _replica_sets)})
+Gauge("db_replicas_healthy", "Read replicas currently receiving queries.", lambda: {(): sum(replicas.healthy() for replicas in _replica_sets)})
+
+# Rate limiting
+
+rate_limit_bans = Counter("rate_limit_bans_total", "Clients banned by the rate limiter.")
+_rate_limiters = []
+
+def register_rate_limiter(middleware):
+    _rate_limiters.append(middleware)
+
+Gauge("rate_limit_tracked_clients", "Client IPs tracked by the rate limiter.", lambda: {(): sum(len(limiter.requests) for limiter in _rate_limiters)})
+Gauge("rate_limit_banned_clients", "Client IPs currently banned by the rate limiter.", lambda: {(): sum(len(limiter.banned_ips) for limiter in _rate_limiters)})
+
+# Write scheduling
+
+write_throttled = Counter("write_throttled_total", "Writes rejected by the write quotas, queue limits and queue timeout, by moderator and reason.", ("moderator", "reason"))
+_write_schedulers = []
+
+def register_write_scheduler(middleware):
+    _write_schedulers.append(middleware)
+
+def _write_queue_depths() -> dict:
+    depths = defaultdict(int)
+    for middleware in _write_schedulers:
+        for identity, waiting in list(middleware.scheduler.queues.items()):
+            depths[(identity,)] += len(waiting)
+        depths[("public",)] += middleware.public.queued()
+    return depths
+
+Gauge("write_queue_depth", "Writes waiting for a write slot, by moderator.", _write_queue_depths, ("moderator",))
+
+# Caches
+
+cache_requests = Counter("cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+
+def record_cache(cache: str, hit: bool):
+    cache_requests.inc((cache, "hit" if hit else "miss"))
+
+def _cache_hit_ratios() -> dict:
+    totals = defaultdict(lambda: [0.0, 0.0])
+    with cache_requests._lock:
+        for (cache, result), value in cache_requests.values.items():
+            totals[cache][0 if result == "hit" else 1] += value
+    return {(cache,): hits / (hits + misses) for cache, (hits, misses) in totals.items() if hits + misses}
+
+Gauge("cache_hit_ratio", "Fraction of cache lookups served from the cache.", _cache_hit_ratios, ("cache",))
@@ -0,0 +1,50 @@
+from logging.config import fileConfig
+from alembic import context
+import re
+
+# models has to be imported before database (see main.py)
+import models
+from database import engine
+
+config = context.config
+# database.migrate_database() runs inside the API and keeps its logging
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+# Monthly audit log tables are created at runtime by audit.py and are not
+# part of the models, so autogenerate must not try to drop them
+AUDIT_PARTITION = re.compile(r"^audit_logs_\d{6}$")
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == "table" and reflected and AUDIT_PARTITION.match(name))
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
+        render_as_batch=engine.dialect.name == "sqlite"
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online() -> None:
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+            # SQLite can only alter tables by copying them
+            render_as_batch=connection.dialect.name == "sqlite"
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,124 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-06-01 00:00:00.000000
+
+Databases created before migrations were introduced already have some or
+all of these tables (they were created with metadata.create_all on startup),
+so every table is only created if it does not exist yet.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _create_table(existing: set, name: str, *columns, indexes: tuple = ()):
+    if name in existing:
+        return
+    op.create_table(name, *columns)
+    for index_columns, unique in indexes:
+        op.create_index(f"ix_{name}_{index_columns[0]}", name, list(index_columns), unique=unique)
+
+
+def upgrade() -> None:
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    _create_table(
+        existing, "blocked_pubkeys",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pubkey", sa.String()),
+        sa.Column("npub", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("ban_reason", sa.String(), nullable=True),
+        indexes=((("id",), False), (("pubkey",), True), (("npub",), True))
+    )
+    _create_table(
+        existing, "blocked_words",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("word", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+        indexes=((("id",), False), (("word",), True))
+    )
+    _create_table(
+        existing, "blocked_ips",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("ip", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("ban_reason", sa.String()),
+        indexes=((("id",), False), (("ip",), True))
+    )
+    _create_table(
+        existing, "temp_bans",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pubkey", sa.String()),
+        sa.Column("expiry_timestamp", sa.DateTime()),
+        indexes=((("id",), False), (("pubkey",), True))
+    )
+    _create_table(
+        existing, "moderators",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("private_key", sa.String(), unique=True),
+        sa.Column("timestamp", sa.DateTime()),
+        indexes=((("id",), False), (("name",), True))
+    )
+    _create_table(
+        existing, "audit_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("action", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("moderator_name", sa.String()),
+        sa.Column("details", sa.String()),
+        indexes=((("id",), False),)
+    )
+    _create_table(
+        existing, "user_reports",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pubkey", sa.String()),
+        sa.Column("report_reason", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("status", sa.String()),
+        sa.Column("reported_by", sa.String()),
+        sa.Column("handled_by", sa.String(), nullable=True),
+        sa.Column("action_taken", sa.String(), nullable=True),
+        indexes=((("id",), False), (("pubkey",), False), (("reported_by",), False))
+    )
+    _create_table(
+        existing, "report_aggregates",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pubkey", sa.String()),
+        sa.Column("reporter_count", sa.Integer()),
+        sa.Column("report_count", sa.Integer()),
+        sa.Column("score_key", sa.Float(), nullable=True),
+        sa.Column("first_report_at", sa.DateTime()),
+        sa.Column("last_report_at", sa.DateTime()),
+        sa.Column("status", sa.String()),
+        indexes=((("id",), False), (("pubkey",), True), (("score_key",), False), (("status",), False))
+    )
+    _create_table(
+        existing, "report_reporters",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pubkey", sa.String()),
+        sa.Column("reported_by", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.UniqueConstraint("pubkey", "reported_by"),
+        indexes=((("id",), False), (("pubkey",), False))
+    )
+    _create_table(
+        existing, "stat_counters",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("value", sa.Integer())
+    )
+
+
+def downgrade() -> None:
+    for name in ("stat_counters", "report_reporters", "report_aggregates", "user_reports", "audit_logs", "moderators", "temp_bans", "blocked_ips", "blocked_words", "blocked_pubkeys"):
+        op.drop_table(name)
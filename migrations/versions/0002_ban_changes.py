@@ -0,0 +1,37 @@
+"""ban changes feed
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-06-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases seeded with metadata.create_all (benchmarks/seed.py) already have it
+    if sa.inspect(op.get_bind()).has_table("ban_changes"):
+        return
+    op.create_table(
+        "ban_changes",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("topic", sa.String()),
+        sa.Column("origin", sa.String()),
+        sa.Column("added", sa.Text()),
+        sa.Column("removed", sa.Text()),
+        sa.Column("created_at", sa.DateTime())
+    )
+    op.create_index("ix_ban_changes_created_at", "ban_changes", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ban_changes_created_at", table_name="ban_changes")
+    op.drop_table("ban_changes")
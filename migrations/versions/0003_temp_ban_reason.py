@@ -0,0 +1,32 @@
+"""temp ban reason and count
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-22 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases seeded with metadata.create_all (benchmarks/seed.py) already have them
+    existing = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("temp_bans")}
+    with op.batch_alter_table("temp_bans") as batch_op:
+        if "ban_reason" not in existing:
+            batch_op.add_column(sa.Column("ban_reason", sa.String(), nullable=True))
+        if "ban_count" not in existing:
+            batch_op.add_column(sa.Column("ban_count", sa.Integer(), server_default="1"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("temp_bans") as batch_op:
+        batch_op.drop_column("ban_count")
+        batch_op.drop_column("ban_reason")
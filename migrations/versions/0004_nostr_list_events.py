@@ -0,0 +1,34 @@
+"""nostr list events
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-06-29 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases seeded with metadata.create_all (benchmarks/seed.py) already have it
+    if sa.inspect(op.get_bind()).has_table("nostr_list_events"):
+        return
+    op.create_table(
+        "nostr_list_events",
+        sa.Column("d_tag", sa.String(), primary_key=True),
+        sa.Column("digest", sa.String()),
+        sa.Column("pubkey", sa.String()),
+        sa.Column("created_at", sa.Integer()),
+        sa.Column("event", sa.Text())
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("nostr_list_events")
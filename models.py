@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -29,6 +29,8 @@ class TempBan(Base):
     id = Column(Integer, primary_key=True, index=True)
     pubkey = Column(String, unique=True, index=True)
     expiry_timestamp = Column(DateTime)
+    ban_reason = Column(String, nullable=True)
+    ban_count = Column(Integer, default=1, server_default="1")  # times banned or extended
 
 class Moderator(Base):
     __tablename__ = "moderators"
@@ -56,4 +58,48 @@ class UserReport(Base):
     handled_by = Column(String, nullable=True)
     action_taken = Column(String, nullable=True)
 
+class ReportAggregate(Base):
+    __tablename__ = "report_aggregates"
+    id = Column(Integer, primary_key=True, index=True)
+    pubkey = Column(String, unique=True, index=True)
+    reporter_count = Column(Integer, default=0)
+    report_count = Column(Integer, default=0)
+    # log2 of the decayed score relative to a fixed epoch, see report_aggregation.py
+    score_key = Column(Float, nullable=True, index=True)
+    first_report_at = Column(DateTime)
+    last_report_at = Column(DateTime)
+    status = Column(String, default="Open", index=True)
+
+class ReportReporter(Base):
+    __tablename__ = "report_reporters"
+    __table_args__ = (UniqueConstraint("pubkey", "reported_by"),)
+    id = Column(Integer, primary_key=True, index=True)
+    pubkey = Column(String, index=True)
+    reported_by = Column(String)
+    timestamp = Column(DateTime)
+
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+    name = Column(String, primary_key=True)
+    value = Column(Integer, default=0)
+
+class BanChange(Base):
+    # Cross-node change feed, see changes.py
+    __tablename__ = "ban_changes"
+    id = Column(Integer, primary_key=True)
+    topic = Column(String)
+    origin = Column(String)
+    added = Column(Text)
+    removed = Column(Text)
+    created_at = Column(DateTime, index=True)
+
+class NostrListEvent(Base):
+    # Signed NIP-51 list chunks shared by all workers, see nostr_lists.py
+    __tablename__ = "nostr_list_events"
+    d_tag = Column(String, primary_key=True)
+    digest = Column(String)
+    pubkey = Column(String)
+    created_at = Column(Integer)
+    event = Column(Text)
+
 # ... other models ... 
\ No newline at end of file
@@ -0,0 +1,243 @@
+from models import NostrListEvent, PublicKey, Word
+from database import SessionLocal
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from dotenv import load_dotenv
+import changes
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import serialization
+import threading
+import time
+
+# The ban lists as signed NIP-51 list events, for relays and clients that
+# consume Nostr lists instead of the REST endpoints.
+#
+# A single mute list (kind 10000) cannot hold hundreds of thousands of
+# entries, so each list is split into chunks published as addressable
+# kind 30000 sets, one per chunk:
+#
+#   pubkeys  chunk = first NOSTR_LIST_PREFIX_LENGTH hex digits of the pubkey
+#            tags  ["d", "azzamo-ban/pubkeys/<chunk>"], ["p", <hex pubkey>]...
+#   words    chunk = first hex digit of sha256(word)
+#            tags  ["d", "azzamo-ban/words/<chunk>"], ["word", <word>]...
+#
+# Entries are sorted within a chunk, so a chunk's event only changes when its
+# entries do. Signed events are stored in the nostr_list_events table, so all
+# workers serve the same events and a restart signs nothing that has not
+# changed. One worker builds at a time (an advisory lock on Postgres, an flock
+# next to the SQLite file): it recomputes the chunks from the database and
+# signs and stores only those whose entries differ from the stored event; the
+# other workers load the stored events. A chunk that becomes empty is
+# published as an empty set so it replaces the old one on relays. Every event
+# is signed with NOSTR_LIST_PRIVATE_KEY. Its created_at is the time of the
+# last change to its list seen by the building worker (the build time if it
+# has seen none since it started), and at least one second after the stored
+# event, as replaceable events require.
+
+load_dotenv()
+
+NOSTR_LIST_PRIVATE_KEY = os.getenv("NOSTR_LIST_PRIVATE_KEY")  # nsec or hex; publishing is disabled without it
+NOSTR_LIST_PREFIX_LENGTH = int(os.getenv("NOSTR_LIST_PREFIX_LENGTH", 3))  # 16 ** n pubkey chunks
+NOSTR_LIST_MAX_AGE = float(os.getenv("NOSTR_LIST_MAX_AGE", 60))  # seconds
+
+LIST_KIND = 30000
+D_TAG_PREFIX = "azzamo-ban"
+WORD_PREFIX_LENGTH = 1
+TOPICS = ("pubkeys", "words")
+
+HEX_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+BUILD_LOCK_ID = 0x617a6e6c  # pg_advisory_xact_lock key for list builds
+LOAD_BATCH_SIZE = 500  # stored events read per query
+
+def private_key_hex(key: str) -> str:
+    from pynostr.key import PrivateKey
+    if key.startswith("nsec"):
+        return PrivateKey.from_nsec(key).hex()
+    return PrivateKey.from_hex(key).hex()
+
+def public_key_hex(private_key: str) -> str:
+    from pynostr.key import PrivateKey
+    return PrivateKey.from_hex(private_key).public_key.hex()
+
+def chunk_pubkeys(pubkeys, prefix_length: int) -> dict[str, list[str]]:
+    chunks = {}
+    for pubkey in sorted({key.lower() for key in pubkeys}):
+        if HEX_KEY.match(pubkey):
+            chunks.setdefault(pubkey[:prefix_length], []).append(pubkey)
+    return chunks
+
+def chunk_words(words) -> dict[str, list[str]]:
+    chunks = {}
+    for word in sorted(set(words)):
+        chunks.setdefault(hashlib.sha256(word.encode()).hexdigest()[:WORD_PREFIX_LENGTH], []).append(word)
+    return chunks
+
+def chunks(pubkeys, words, prefix_length: int) -> dict[str, tuple[str, list[str]]]:
+    # d tag -> (tag name, sorted entries)
+    result = {}
+    for prefix, entries in chunk_pubkeys(pubkeys, prefix_length).items():
+        result[f"{D_TAG_PREFIX}/pubkeys/{prefix}"] = ("p", entries)
+    for prefix, entries in chunk_words(words).items():
+        result[f"{D_TAG_PREFIX}/words/{prefix}"] = ("word", entries)
+    return result
+
+def digest(tag_name: str, entries: list[str]) -> str:
+    return hashlib.sha256("\n".join([tag_name, *entries]).encode()).hexdigest()
+
+def build_event(d_tag: str, tag_name: str, entries: list[str], private_key: str, created_at: int) -> dict:
+    from pynostr.event import Event
+    event = Event(kind=LIST_KIND, content="", created_at=created_at, tags=[["d", d_tag]] + [[tag_name, entry] for entry in entries])
+    event.sign(private_key)
+    return event.to_dict()
+
+def verify(event: dict) -> bool:
+    # Checks the id and the signature of a served event
+    from pynostr.event import Event
+    parsed = Event.from_dict(event)
+    return parsed.id == event["id"] and parsed.verify()
+
+@contextlib.contextmanager
+def _build_lock(db):
+    # Held until the build's transaction ends
+    bind = db.get_bind()
+    if bind.dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": BUILD_LOCK_ID})
+        yield
+        return
+    if not bind.url.database or bind.url.database == ":memory:":
+        yield
+        return
+    with open(bind.url.database + ".nostr-lists.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+class ListPublisher:
+    def __init__(self, session_factory, private_key: str | None, prefix_length: int, max_age: float):
+        self.session_factory = session_factory
+        self.private_key = private_key_hex(private_key) if private_key else None
+        self.public_key = public_key_hex(self.private_key) if self.private_key else None
+        self.prefix_length = prefix_length
+        self.max_age = max_age
+        # d tag -> (digest, event), the stored events this worker has loaded
+        self.events = {}
+        # (events, JSON body, etag), replaced as a whole so readers never see a mix
+        self.current = None
+        self.signed = 0
+        self.reused = 0
+        self._versions = None
+        self._built_at = 0.0
+        # topic -> wall clock time of the last change seen
+        self._changed_at = {}
+        self._lock = threading.Lock()
+        for topic in TOPICS:
+            changes.subscribe(topic, functools.partial(self._on_change, topic))
+
+    def _on_change(self, topic: str, added, removed):
+        self._changed_at[topic] = time.time()
+
+    @property
+    def enabled(self) -> bool:
+        return self.private_key is not None
+
+    def _fresh(self) -> bool:
+        return self.current is not None and self._versions == tuple(map(changes.version, TOPICS)) and time.monotonic() - self._built_at < self.max_age
+
+    def get(self) -> tuple[list[dict], bytes, str]:
+        if not self._fresh():
+            with self._lock:
+                # Concurrent requests wait for a single rebuild
+                if not self._fresh():
+                    self.build()
+        return self.current
+
+    def build(self):
+        # Read the versions first; a change committed during the build only
+        # causes another rebuild
+        versions = tuple(map(changes.version, TOPICS))
+        started = time.perf_counter()
+        signed = {}
+        db = self.session_factory()
+        try:
+            with _build_lock(db):
+                stored = {row.d_tag: row for row in db.execute(select(NostrListEvent.d_tag, NostrListEvent.digest, NostrListEvent.pubkey, NostrListEvent.created_at))}
+                # From the primary, like the writes that follow
+                pubkeys = db.execute(select(PublicKey.pubkey)).scalars().all()
+                words = db.execute(select(Word.word)).scalars().all()
+                current = chunks(pubkeys, words, self.prefix_length)
+                # Chunks that are gone are published once more, empty
+                for d_tag in stored.keys() - current.keys():
+                    current[d_tag] = ("p" if d_tag.startswith(f"{D_TAG_PREFIX}/pubkeys/") else "word", [])
+
+                digests = {}
+                for d_tag, (tag_name, entries) in current.items():
+                    chunk_digest = digests[d_tag] = digest(tag_name, entries)
+                    previous = stored.get(d_tag)
+                    if previous is not None and previous.digest == chunk_digest and previous.pubkey == self.public_key:
+                        continue
+                    created_at = int(self._changed_at.get(d_tag.split("/")[1]) or time.time())
+                    if previous is not None:
+                        created_at = max(created_at, previous.created_at + 1)
+                    signed[d_tag] = (chunk_digest, build_event(d_tag, tag_name, entries, self.private_key, created_at))
+
+                if signed:
+                    insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+                    statement = insert(NostrListEvent)
+                    statement = statement.on_conflict_do_update(
+                        index_elements=[NostrListEvent.d_tag],
+                        set_={name: statement.excluded[name] for name in ("digest", "pubkey", "created_at", "event")}
+                    )
+                    db.execute(statement, [
+                        {"d_tag": d_tag, "digest": chunk_digest, "pubkey": self.public_key, "created_at": event["created_at"], "event": json.dumps(event)}
+                        for d_tag, (chunk_digest, event) in signed.items()
+                    ])
+                db.commit()
+
+            # Stored events this worker has not loaded yet, all of them after a restart
+            events = {d_tag: self.events[d_tag] for d_tag in current if d_tag not in signed and self.events.get(d_tag, ("",))[0] == digests[d_tag]}
+            missing = [d_tag for d_tag in current if d_tag not in signed and d_tag not in events]
+            for offset in range(0, len(missing), LOAD_BATCH_SIZE):
+                batch = missing[offset:offset + LOAD_BATCH_SIZE]
+                for d_tag, chunk_digest, event in db.execute(select(NostrListEvent.d_tag, NostrListEvent.digest, NostrListEvent.event).where(NostrListEvent.d_tag.in_(batch))):
+                    events[d_tag] = (chunk_digest, json.loads(event))
+            events.update(signed)
+        finally:
+            db.close()
+
+        served = [events[d_tag][1] for d_tag in sorted(events)]
+        body = serialization.dumps(served)
+        etag = '"' + hashlib.sha256("".join(event["id"] for event in served).encode()).hexdigest()[:32] + '"'
+        self.events = events
+        self.current = (served, body, etag)
+        self.signed += len(signed)
+        self.reused += len(events) - len(signed)
+        self._versions = versions
+        self._built_at = time.monotonic()
+        if signed:
+            logging.info(f"Signed {len(signed)} of {len(events)} Nostr list events in {time.perf_counter() - started:.2f}s")
+
+    def status(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        served = self.current[0] if self.current is not None else []
+        return {
+            "enabled": True,
+            "pubkey": self.public_key,
+            "events": len(served),
+            "signed": self.signed,
+            "reused": self.reused,
+            "age_seconds": round(time.monotonic() - self._built_at, 1) if self.current is not None else None
+        }
+
+publisher = ListPublisher(SessionLocal, NOSTR_LIST_PRIVATE_KEY, NOSTR_LIST_PREFIX_LENGTH, NOSTR_LIST_MAX_AGE)
@@ -0,0 +1,214 @@
+from database import engine
+from sqlalchemy import event
+from dotenv import load_dotenv
+from collections import defaultdict, deque
+from datetime import datetime
+from time import perf_counter
+import logging
+import os
+import sys
+import threading
+
+# Opt-in profiling, switched on and off at runtime through the /admin/profiling
+# endpoints. Nothing here costs anything while it is off: the sampler thread is
+# only running while sampling is enabled and the slow query hooks are only
+# attached to the engine while slow query tracing is enabled.
+#
+# The sampler periodically snapshots the stack of every other thread with
+# sys._current_frames() and counts identical stacks. The result is exported in
+# the "collapsed" format (frame;frame;frame count) that flamegraph.pl,
+# speedscope and inferno read directly.
+#
+# Settings are per process; with several workers each one has to be enabled.
+
+load_dotenv()
+
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 5))  # milliseconds
+PROFILE_SLOW_QUERY_MS = float(os.getenv("PROFILE_SLOW_QUERY_MS", 100))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", 10000))
+PROFILE_SLOW_QUERY_HISTORY = 100
+
+# Leaf frames of threads that are parked rather than working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}"
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: float, max_stacks: int):
+        self.interval_ms = interval_ms
+        self.max_stacks = max_stacks
+        self.stacks = defaultdict(int)
+        self.samples = 0
+        self.truncated = 0
+        self.started_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.started_at = datetime.utcnow()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.truncated = 0
+
+    def sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or _is_idle(frame):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, "thread"))
+            stack = ";".join(reversed(labels))
+            with self._lock:
+                if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[stack] += 1
+                else:
+                    self.truncated += 1
+                self.samples += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            items = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_ms / 1000):
+            self.sample()
+
+class SlowQueryTracer:
+    def __init__(self, engine, threshold_ms: float, history: int):
+        self.engine = engine
+        self.threshold_ms = threshold_ms
+        self.enabled = False
+        self.recent = deque(maxlen=history)
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(self.engine, "before_cursor_execute", self._before)
+            event.listen(self.engine, "after_cursor_execute", self._after)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(self.engine, "before_cursor_execute", self._before)
+            event.remove(self.engine, "after_cursor_execute", self._after)
+            self.enabled = False
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        context._profiling_started = perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_profiling_started", None)
+        if started is None:
+            return
+        duration_ms = (perf_counter() - started) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        plan = None if executemany else self._explain(conn, statement, parameters)
+        entry = {
+            "timestamp": datetime.utcnow(),
+            "duration_ms": round(duration_ms, 3),
+            "statement": statement,
+            "parameters": repr(parameters),
+            "plan": plan
+        }
+        self.recent.append(entry)
+        logging.warning(f"Slow query ({duration_ms:.1f} ms): {statement} parameters={parameters!r}" + (f"\n{plan}" if plan else ""))
+
+    def _explain(self, conn, statement: str, parameters) -> str | None:
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            return None
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        # On a raw DBAPI cursor, so the EXPLAIN does not go through the engine
+        # events (this tracer and the query metrics), and on Postgres inside a
+        # savepoint, so a failed EXPLAIN does not abort the request's transaction
+        savepoint = conn.dialect.name == "postgresql"
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception as e:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                return f"EXPLAIN failed: {e}"
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            return "\n".join(" | ".join(str(value) for value in row) for row in rows)
+        finally:
+            cursor.close()
+
+profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL, PROFILE_MAX_STACKS)
+slow_queries = SlowQueryTracer(engine, PROFILE_SLOW_QUERY_MS, PROFILE_SLOW_QUERY_HISTORY)
+
+def configure(sampling: bool | None = None, sample_interval_ms: float | None = None, slow_queries_enabled: bool | None = None, slow_query_ms: float | None = None):
+    # Only the settings that are passed are changed
+    if sample_interval_ms is not None:
+        profiler.interval_ms = max(sample_interval_ms, 1.0)
+    if sampling is True:
+        profiler.start()
+    elif sampling is False:
+        profiler.stop()
+    if slow_query_ms is not None:
+        slow_queries.threshold_ms = max(slow_query_ms, 0.0)
+    if slow_queries_enabled is True:
+        slow_queries.enable()
+    elif slow_queries_enabled is False:
+        slow_queries.disable()
+    return status()
+
+def status() -> dict:
+    return {
+        "sampling": profiler.running,
+        "sample_interval_ms": profiler.interval_ms,
+        "samples": profiler.samples,
+        "unique_stacks": len(profiler.stacks),
+        "truncated_samples": profiler.truncated,
+        "sampling_since": profiler.started_at,
+        "slow_queries": slow_queries.enabled,
+        "slow_query_ms": slow_queries.threshold_ms,
+        "slow_queries_recorded": len(slow_queries.recent)
+    }
+
+def stop():
+    profiler.stop()
+    slow_queries.disable()
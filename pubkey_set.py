@@ -0,0 +1,215 @@
+from models import PublicKey, TempBan
+from database import SessionLocal, engine
+from sqlalchemy import select
+from dotenv import load_dotenv
+from datetime import datetime
+import blocklist
+import changes
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+# Compact membership set of the banned pubkeys, so check_pubkey_status can
+# answer the common "not banned" case without a query.
+#
+# The set is the union of blocked_pubkeys and the active temp bans, packed
+# with blocklist.pack(): a header followed by the sorted raw 32-byte keys,
+# about 64 MB for 2M keys instead of well over 200 MB of Python strings. It is
+# written to PUBKEY_SET_PATH and memory-mapped read-only, so all workers on a
+# host share one copy through the page cache. One worker rebuilds the file at
+# a time, under an exclusive flock on PUBKEY_SET_PATH + ".lock", and replaces
+# it atomically; the others notice the new file and map it.
+#
+# Keys banned after the file was generated, here or through the change feed
+# from other workers, are kept in a small overlay until a file generated
+# after them has been mapped. For the same reason a worker only maps files
+# generated after it subscribed to the changes. A ban made by another worker
+# is therefore missed for as long as the change feed takes to deliver it, and
+# the set is not used at all with CHANGES_BROADCAST off.
+# Lifted bans are not taken out; a hit only means "ask the database", so they
+# just cost a query until the next rebuild. The file is rebuilt in the
+# background every PUBKEY_SET_MAX_AGE seconds, or once the overlay holds
+# PUBKEY_SET_MAX_OVERLAY keys. A worker that finds the lock taken, or whose
+# rebuild fails, waits REBUILD_BACKOFF seconds before it tries again.
+#
+# The file decides which keys are reported as not banned, so it is kept next
+# to the SQLite file, or in a private directory for other databases, and only
+# mapped when it is owned by this user and not writable by anyone else.
+
+load_dotenv()
+
+def _owned_privately(stat: os.stat_result) -> bool:
+    return stat.st_uid == os.geteuid() and not stat.st_mode & 0o022
+
+def _default_path() -> str | None:
+    if engine.url.get_backend_name() == "sqlite" and engine.url.database and engine.url.database != ":memory:":
+        return os.path.abspath(engine.url.database) + ".pubkey-set.bin"
+    directory = os.path.join(tempfile.gettempdir(), f"azzamo-ban-{os.geteuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not _owned_privately(os.stat(directory)):
+        logging.error(f"Not using the pubkey set: {directory} is not a private directory, set PUBKEY_SET_PATH")
+        return None
+    return os.path.join(directory, f"pubkey-set-{hashlib.sha256(engine.url.render_as_string().encode()).hexdigest()[:12]}.bin")
+
+# Without the change feed, bans made by other workers would be missed until the next rebuild
+PUBKEY_SET_ENABLED = os.getenv("PUBKEY_SET_ENABLED", "True").lower() == "true" and changes.CHANGES_BROADCAST
+PUBKEY_SET_PATH = os.getenv("PUBKEY_SET_PATH") or (_default_path() if PUBKEY_SET_ENABLED else None)
+PUBKEY_SET_ENABLED = PUBKEY_SET_ENABLED and PUBKEY_SET_PATH is not None
+PUBKEY_SET_MAX_AGE = float(os.getenv("PUBKEY_SET_MAX_AGE", 300))  # seconds
+PUBKEY_SET_MAX_OVERLAY = int(os.getenv("PUBKEY_SET_MAX_OVERLAY", 10000))  # keys banned since the last rebuild
+
+STAT_INTERVAL = 1.0  # seconds between checks for a file rebuilt by another worker
+REBUILD_BACKOFF = 5.0  # seconds between rebuild attempts that found the lock taken or failed
+
+class PubkeySet:
+    def __init__(self, session_factory, path: str, max_age: float, max_overlay: int):
+        self.session_factory = session_factory
+        self.path = path
+        self.max_age = max_age
+        self.max_overlay = max_overlay
+        self.mapped = None
+        self.generated_at = 0
+        self.count = 0
+        self._file_id = None
+        self._rejected_id = None
+        self._checked_at = 0.0
+        # pubkey -> wall clock time it was banned
+        self._overlay = {}
+        # Bans from before this are only known from a file generated after it
+        self._since = time.time()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._rebuilding = False
+        self._retry_at = 0.0
+        changes.subscribe("pubkeys", self._on_change)
+        changes.subscribe("temp_bans", self._on_change)
+
+    def _on_change(self, added, removed):
+        now = time.time()
+        with self._lock:
+            for pubkey in added:
+                self._overlay[pubkey.lower()] = now
+
+    def __contains__(self, pubkey: str) -> bool:
+        pubkey = pubkey.lower()
+        if not blocklist.HEX_KEY.match(pubkey):
+            # Never packed, so only the database can tell
+            return True
+        self._refresh()
+        if pubkey in self._overlay:
+            return True
+        mapped = self.mapped
+        return mapped is None or blocklist.contains(mapped, pubkey)
+
+    def _refresh(self):
+        if self.mapped is None:
+            with self._build_lock:
+                if self.mapped is None:
+                    # Nothing to answer from yet, so the first lookups wait for a build
+                    self._map() or self._build(blocking=True)
+            return
+
+        now = time.monotonic()
+        if now - self._checked_at > STAT_INTERVAL:
+            self._checked_at = now
+            self._map()
+        if not self._rebuilding and now >= self._retry_at and (time.time() - self.generated_at > self.max_age or len(self._overlay) >= self.max_overlay):
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, name="pubkey-set-rebuild", daemon=True).start()
+
+    def _map(self) -> bool:
+        # Maps the file if it was (re)written since it was last mapped
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_id == self._file_id:
+            return True
+        if file_id == self._rejected_id:
+            return False
+        with open(self.path, "rb") as f:
+            # Checked on the open file, so it cannot be swapped after the check
+            if not _owned_privately(os.fstat(f.fileno())):
+                logging.warning(f"Not mapping {self.path}: it is not owned by this user or is writable by others")
+                self._rejected_id = file_id
+                return False
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = blocklist.unpack_header(mapped)
+        if header["generated_at"] < self._since - 1:
+            # Left over from before this worker followed the change feed
+            mapped.close()
+            return False
+        with self._lock:
+            # Readers may still hold the previous mapping; it is closed once they drop it
+            self.mapped = mapped
+            self.generated_at = header["generated_at"]
+            self.count = header["count"]
+            self._file_id = file_id
+            # Bans from before the file was generated are in it
+            self._overlay = {pubkey: banned_at for pubkey, banned_at in self._overlay.items() if banned_at >= self.generated_at - 1}
+        return True
+
+    def _build(self, blocking: bool) -> bool:
+        # False when another worker holds the lock
+        with open(self.path + ".lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is rebuilding it
+                return False
+            try:
+                # Another worker may have rebuilt it while this one waited for the lock
+                if self._map() and time.time() - self.generated_at < self.max_age and len(self._overlay) < self.max_overlay:
+                    return True
+                started = time.perf_counter()
+                generated_at = int(time.time())
+                data = blocklist.pack(self._load_keys(), generated_at)
+                temporary = f"{self.path}.{os.getpid()}.tmp"
+                with open(temporary, "wb") as f:
+                    f.write(data)
+                os.replace(temporary, self.path)
+                self._map()
+                logging.info(f"Built pubkey set of {self.count} keys ({len(data) // 1024} KiB) in {time.perf_counter() - started:.2f}s")
+                return True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_keys(self) -> set[str]:
+        db = self.session_factory()
+        try:
+            pubkeys = db.execute(select(PublicKey.pubkey)).scalars().all()
+            temp_banned = db.execute(select(TempBan.pubkey).where(TempBan.expiry_timestamp > datetime.utcnow())).scalars().all()
+        finally:
+            db.close()
+        return set(pubkeys).union(temp_banned)
+
+    def _rebuild_in_background(self):
+        try:
+            with self._build_lock:
+                if not self._build(blocking=False):
+                    self._retry_at = time.monotonic() + REBUILD_BACKOFF
+        except Exception as e:
+            logging.error(f"Error rebuilding pubkey set: {e}")
+            self._retry_at = time.monotonic() + REBUILD_BACKOFF
+        finally:
+            self._rebuilding = False
+
+    def status(self) -> dict:
+        if not PUBKEY_SET_ENABLED:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "path": self.path,
+            "mapped": self.mapped is not None,
+            "keys": self.count,
+            "overlay": len(self._overlay),
+            "age_seconds": round(time.time() - self.generated_at) if self.mapped is not None else None
+        }
+
+banned = PubkeySet(SessionLocal, PUBKEY_SET_PATH, PUBKEY_SET_MAX_AGE, PUBKEY_SET_MAX_OVERLAY)
@@ -3,6 +3,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 import time
 import os
+import metrics
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
     def __init__(self, app, rate_limit: int, ban_duration: int):
@@ -11,6 +12,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         self.ban_duration = ban_duration
         self.requests = {}
         self.banned_ips = {}
+        metrics.register_rate_limiter(self)
 
     async def dispatch(self, request: Request, call_next):
         client_ip = request.client.host
@@ -33,6 +35,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         if len(self.requests[client_ip]) >= self.rate_limit:
             # Ban the IP
             self.banned_ips[client_ip] = current_time + self.ban_duration
+            metrics.rate_limit_bans.inc()
             return Response("Too many requests, IP banned", status_code=429)
 
         self.requests[client_ip].append(current_time)
@@ -0,0 +1,53 @@
+import math
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Scoring and escalation rules for the per-pubkey report aggregates.
+#
+# Every distinct reporter adds 1 to a pubkey's score and the score halves every
+# REPORT_SCORE_HALF_LIFE hours. Instead of storing the decayed value (which would
+# have to be rewritten for every row as time passes) we store
+#
+#     score_key = log2(sum(2 ** ((t_i - EPOCH) / half_life)))
+#
+# The current score is 2 ** (score_key - (now - EPOCH) / half_life), and because
+# the subtracted term is the same for every row, ordering by score_key orders by
+# current score. That lets the moderator queue use a plain index.
+
+load_dotenv()
+
+EPOCH = datetime(2024, 1, 1)
+
+REPORT_SCORE_HALF_LIFE = float(os.getenv("REPORT_SCORE_HALF_LIFE", 24))  # hours
+REPORT_QUEUE_MIN_REPORTERS = int(os.getenv("REPORT_QUEUE_MIN_REPORTERS", 3))
+REPORT_AUTO_TEMP_BAN_MIN_REPORTERS = int(os.getenv("REPORT_AUTO_TEMP_BAN_MIN_REPORTERS", 10))
+REPORT_AUTO_TEMP_BAN_MIN_SCORE = float(os.getenv("REPORT_AUTO_TEMP_BAN_MIN_SCORE", 5))
+REPORT_AUTO_TEMP_BAN_DURATION = int(os.getenv("REPORT_AUTO_TEMP_BAN_DURATION", 24))  # hours
+
+def _decay_units(timestamp: datetime) -> float:
+    return (timestamp - EPOCH).total_seconds() / (REPORT_SCORE_HALF_LIFE * 3600)
+
+def add_to_score_key(score_key: float | None, timestamp: datetime) -> float:
+    # log2(2**a + 2**b) computed without overflowing
+    units = _decay_units(timestamp)
+    if score_key is None:
+        return units
+    high, low = max(score_key, units), min(score_key, units)
+    return high + math.log2(1 + 2 ** (low - high))
+
+def current_score(score_key: float | None, now: datetime | None = None) -> float:
+    if score_key is None:
+        return 0.0
+    return 2 ** (score_key - _decay_units(now or datetime.utcnow()))
+
+def should_temp_ban(reporter_count: int, score: float) -> bool:
+    # A threshold of 0 disables automatic temporary bans
+    if REPORT_AUTO_TEMP_BAN_MIN_REPORTERS <= 0:
+        return False
+    return reporter_count >= REPORT_AUTO_TEMP_BAN_MIN_REPORTERS and score >= REPORT_AUTO_TEMP_BAN_MIN_SCORE
+
+def should_queue(reporter_count: int) -> bool:
+    if REPORT_QUEUE_MIN_REPORTERS <= 0:
+        return False
+    return reporter_count >= REPORT_QUEUE_MIN_REPORTERS
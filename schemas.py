@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional
 
@@ -53,7 +53,8 @@ class IPAddressCreate(IPAddressBase):
 
 class IPAddress(IPAddressBase):
     id: int
-    timestamp: str
+    timestamp: datetime
+    ban_reason: str | None = None
 
     class Config:
         from_attributes = True
@@ -72,6 +73,9 @@ class TempBanCreate(BaseModel):
             }
         }
 
+class TempBanBatch(BaseModel):
+    bans: list[TempBanCreate] = Field(max_length=1000)
+
 class ModeratorCreate(BaseModel):
     name: str
     private_key: str
@@ -123,11 +127,16 @@ class AuditLog(BaseModel):
     id: int
     action: str
     timestamp: datetime
-    performed_by: str
+    moderator_name: str | None = None
+    details: str | None = None
 
     class Config:
         from_attributes = True
 
+class AuditLogPage(BaseModel):
+    items: list[AuditLog]
+    next_cursor: str | None = None
+
 class UserReportResponse(BaseModel):
     id: int
     timestamp: datetime
@@ -139,11 +148,36 @@ class UserReportResponse(BaseModel):
     pubkey: str
     report_reason: Optional[str]
 
+class ReportAggregate(BaseModel):
+    pubkey: str
+    reporter_count: int
+    report_count: int
+    score: float
+    first_report_at: datetime
+    last_report_at: datetime
+    status: str
+
 class ReportApproval(BaseModel):
     report_id: Optional[int] = None
     pubkey: Optional[str] = None
     moderator_name: str
 
+class ProfilingSettings(BaseModel):
+    sampling: bool | None = None
+    sample_interval_ms: float | None = None
+    slow_queries: bool | None = None
+    slow_query_ms: float | None = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "sampling": True,
+                "sample_interval_ms": 5,
+                "slow_queries": True,
+                "slow_query_ms": 50
+            }
+        }
+
 class BanReasonUpdate(BaseModel):
     pubkey: str
     reason: str
@@ -0,0 +1,48 @@
+from fastapi.responses import Response
+from datetime import datetime
+import json
+
+# Fast path for large list responses.
+#
+# Returning ORM objects makes FastAPI build and validate one response_model
+# instance per row before encoding it, which dominates the CPU time of the full
+# list endpoints. Instead, the crud functions behind those routes select only
+# the columns named in the response schema as plain row tuples, and the routes
+# encode them directly with FastJSONResponse. FastAPI passes Response objects
+# through untouched, so the routes keep their response_model for OpenAPI.
+#
+# orjson is used when it is installed; otherwise the standard library encoder
+# produces the same output, only slower.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        # Naive datetimes are written as ISO 8601 without an offset, like pydantic
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+def fields(schema) -> list[str]:
+    return list(schema.model_fields)
+
+def columns(model, schema) -> list:
+    # The model columns backing each field of the response schema, in order
+    return [getattr(model, name) for name in fields(schema)]
+
+def rows_response(rows, schema) -> FastJSONResponse:
+    names = fields(schema)
+    return FastJSONResponse([dict(zip(names, row)) for row in rows])
@@ -0,0 +1,261 @@
+from database import SessionLocal
+from models import PublicKey, IPAddress, Word, TempBan, UserReport, StatCounter
+from sqlalchemy import func, update, insert, delete
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+from collections import defaultdict
+from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right, insort
+import atexit
+import logging
+import os
+import threading
+import time
+
+# In-memory statistics for /stats.
+#
+# The mutation paths in crud.py report their changes here after committing.
+# Counter changes are applied to memory straight away and kept as pending
+# deltas, which a background thread adds to the stat_counters summary table
+# every STATS_FLUSH_INTERVAL seconds before reloading the table, so every worker
+# picks up the others' changes. Every STATS_RECONCILE_INTERVAL seconds the real
+# counts are recomputed and written over the summary table to correct any drift.
+#
+# Counter names in the summary table:
+#   blocked_pubkeys, blocked_ips, blocked_words, temporary_bans
+#   reports:<status>          number of user reports per status
+#   bans:<YYYY-MM-DD>         blocked pubkeys by the day they were banned
+
+load_dotenv()
+
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", 5))  # seconds
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", 300))  # seconds
+STATS_HISTORY_DAYS = int(os.getenv("STATS_HISTORY_DAYS", 30))
+STATS_EXPIRING_WINDOW = int(os.getenv("STATS_EXPIRING_WINDOW", 24))  # hours
+
+class StatsCache:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.values = defaultdict(int)
+        self.pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._loaded = False
+        self._stopped = False
+        self._thread = None
+        # Active temporary bans, kept sorted by expiry for the expiring-soon count
+        self._temp_ban_expiries = {}
+        self._expiry_index = []
+
+    # Mutation hooks, called by crud.py after a successful commit
+
+    def incr(self, name: str, delta: int = 1):
+        with self._lock:
+            self.values[name] += delta
+            self.pending[name] += delta
+        if self._thread is None:
+            self._start()
+
+    def ban_added(self, timestamp: datetime):
+        self.incr("blocked_pubkeys")
+        self.incr(f"bans:{timestamp.date().isoformat()}")
+
+    def ban_removed(self, timestamp: datetime | None):
+        self.incr("blocked_pubkeys", -1)
+        if timestamp:
+            self.incr(f"bans:{timestamp.date().isoformat()}", -1)
+
+    def report_status_changed(self, old_status: str | None, new_status: str | None):
+        if old_status == new_status:
+            return
+        if old_status:
+            self.incr(f"reports:{old_status}", -1)
+        if new_status:
+            self.incr(f"reports:{new_status}")
+
+    def temp_ban_set(self, pubkey: str, expiry: datetime, created: bool):
+        if created:
+            self.incr("temporary_bans")
+        with self._lock:
+            self._discard_expiry(pubkey)
+            self._temp_ban_expiries[pubkey] = expiry
+            insort(self._expiry_index, (expiry, pubkey))
+
+    def temp_ban_removed(self, pubkey: str):
+        self.incr("temporary_bans", -1)
+        with self._lock:
+            self._discard_expiry(pubkey)
+
+    def _discard_expiry(self, pubkey: str):
+        expiry = self._temp_ban_expiries.pop(pubkey, None)
+        if expiry is not None:
+            index = bisect_left(self._expiry_index, (expiry, pubkey))
+            if index < len(self._expiry_index) and self._expiry_index[index] == (expiry, pubkey):
+                del self._expiry_index[index]
+
+    # Reads
+
+    def snapshot(self) -> dict:
+        self._ensure_loaded()
+        now = datetime.utcnow()
+        today = now.date()
+        with self._lock:
+            expiring = bisect_right(self._expiry_index, (now + timedelta(hours=STATS_EXPIRING_WINDOW), "")) - bisect_left(self._expiry_index, (now, ""))
+            reports_by_status = {name.split(":", 1)[1]: value for name, value in self.values.items() if name.startswith("reports:") and value}
+            bans_per_day = {}
+            for offset in range(STATS_HISTORY_DAYS - 1, -1, -1):
+                day = (today - timedelta(days=offset)).isoformat()
+                bans_per_day[day] = self.values.get(f"bans:{day}", 0)
+            return {
+                "blocked_pubkeys": self.values["blocked_pubkeys"],
+                "blocked_ips": self.values["blocked_ips"],
+                "blocked_words": self.values["blocked_words"],
+                "temporary_bans": self.values["temporary_bans"],
+                "temp_bans_expiring_soon": expiring,
+                "reports_by_status": reports_by_status,
+                "bans_per_day": bans_per_day
+            }
+
+    # Persistence
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            # Serve the persisted counters right away; only an empty summary
+            # table (first start) needs the real counts up front
+            if not self.refresh():
+                self.reconcile()
+            else:
+                self._load_temp_ban_expiries()
+            self._loaded = True
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name="stats-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def flush(self):
+        with self._lock:
+            deltas = {name: delta for name, delta in self.pending.items() if delta}
+            self.pending.clear()
+        if not deltas:
+            return
+
+        db = self.session_factory()
+        try:
+            for name, delta in deltas.items():
+                result = db.execute(update(StatCounter).where(StatCounter.name == name).values(value=StatCounter.value + delta))
+                if result.rowcount == 0:
+                    db.execute(insert(StatCounter).values(name=name, value=delta))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Error flushing statistics counters: {e}")
+            with self._lock:
+                for name, delta in deltas.items():
+                    self.pending[name] += delta
+        finally:
+            db.close()
+
+    def refresh(self) -> bool:
+        db = self.session_factory()
+        try:
+            rows = db.query(StatCounter.name, StatCounter.value).all()
+        finally:
+            db.close()
+        if not rows:
+            return False
+        with self._lock:
+            values = defaultdict(int, {name: value for name, value in rows})
+            for name, delta in self.pending.items():
+                values[name] += delta
+            self.values = values
+        return True
+
+    def reconcile(self):
+        with self._lock:
+            # The real counts below include what was pending so far, but not
+            # deltas recorded while they are being counted
+            counted = dict(self.pending)
+
+        history_start = datetime.utcnow() - timedelta(days=STATS_HISTORY_DAYS)
+        db = self.session_factory()
+        try:
+            values = {
+                "blocked_pubkeys": db.query(PublicKey).count(),
+                "blocked_ips": db.query(IPAddress).count(),
+                "blocked_words": db.query(Word).count(),
+                "temporary_bans": db.query(TempBan).count()
+            }
+            for status, count in db.query(UserReport.status, func.count(UserReport.id)).group_by(UserReport.status):
+                values[f"reports:{status}"] = count
+            ban_day = func.date(PublicKey.timestamp)
+            for day, count in db.query(ban_day, func.count(PublicKey.id)).filter(PublicKey.timestamp >= history_start).group_by(ban_day):
+                values[f"bans:{day}"] = count
+
+            db.execute(delete(StatCounter))
+            db.execute(insert(StatCounter), [{"name": name, "value": value} for name, value in values.items()])
+            db.commit()
+        except IntegrityError:
+            # Another worker reconciled at the same time, its numbers are as good
+            db.rollback()
+        finally:
+            db.close()
+
+        with self._lock:
+            for name, delta in counted.items():
+                self.pending[name] -= delta
+                if not self.pending[name]:
+                    del self.pending[name]
+            merged = defaultdict(int, values)
+            for name, delta in self.pending.items():
+                merged[name] += delta
+            self.values = merged
+        self._load_temp_ban_expiries()
+
+    def _load_temp_ban_expiries(self):
+        db = self.session_factory()
+        try:
+            rows = db.query(TempBan.pubkey, TempBan.expiry_timestamp).filter(TempBan.expiry_timestamp > datetime.utcnow()).all()
+        finally:
+            db.close()
+        with self._lock:
+            self._temp_ban_expiries = {pubkey: expiry for pubkey, expiry in rows}
+            self._expiry_index = sorted((expiry, pubkey) for pubkey, expiry in rows)
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        try:
+            self._ensure_loaded()
+        except Exception as e:
+            logging.error(f"Error loading statistics: {e}")
+        reconciled_at = time.monotonic()
+        while not self._stopped:
+            self._wakeup.wait(STATS_FLUSH_INTERVAL)
+            if self._stopped:
+                break
+            try:
+                self.flush()
+                if time.monotonic() - reconciled_at > STATS_RECONCILE_INTERVAL:
+                    reconciled_at = time.monotonic()
+                    self.reconcile()
+                else:
+                    self.refresh()
+            except Exception as e:
+                logging.error(f"Error refreshing statistics: {e}")
+
+cache = StatsCache(SessionLocal)
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The modules read their configuration at import time, so point them at a
+# throwaway SQLite database before any test imports them
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='azzamo-tests-')}/test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# models has to be imported before database, which imports it back
+import models
@@ -0,0 +1,33 @@
+from database import SessionLocal
+from sqlalchemy import insert
+from datetime import datetime, timedelta, timezone
+import audit
+
+def test_cursor_pages_cover_every_entry_once_across_months():
+    # Entries on both sides of a month boundary, several sharing a timestamp
+    boundary = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    timestamps = [boundary - timedelta(seconds=2)] * 3 + [boundary - timedelta(seconds=1)] + [boundary] * 4 + [boundary + timedelta(seconds=1)] * 2
+    db = SessionLocal()
+    try:
+        # Month tables are created before the session takes the write lock, as AuditWriter does
+        tables = {timestamp: audit.partitions.ensure(audit.month_key(timestamp)) for timestamp in timestamps}
+        for timestamp in timestamps:
+            db.execute(insert(tables[timestamp]).values(action="test_pages", timestamp=timestamp, moderator_name="test", details="{}"))
+        db.commit()
+
+        # Aware bounds are compared as naive UTC
+        end = datetime.now(timezone.utc) + timedelta(days=1)
+        seen = []
+        cursor = None
+        while True:
+            page = audit.query(db, end=end, action="test_pages", limit=3, cursor=cursor)
+            seen.extend((item["timestamp"], item["id"]) for item in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+    finally:
+        db.close()
+
+    assert len(seen) == len(set(seen)) == len(timestamps)
+    assert seen == sorted(seen, reverse=True)
+    assert sorted(timestamp for timestamp, entry_id in seen) == sorted(timestamps)
@@ -0,0 +1,71 @@
+from models import Base, BanChange
+from database import engine, SessionLocal
+from sqlalchemy import insert
+from datetime import datetime
+import changes
+import pytest
+
+@pytest.fixture
+def feeds(monkeypatch):
+    # Two processes sharing one database, each with its own node id
+    Base.metadata.create_all(engine)
+    first = changes.ChangeFeed(engine, SessionLocal, node_id="first")
+    second = changes.ChangeFeed(engine, SessionLocal, node_id="second")
+    for feed in (first, second):
+        # Flushed and polled by the test instead of the background thread
+        monkeypatch.setattr(feed, "start", lambda: None)
+        feed.poll()
+    return first, second
+
+@pytest.fixture
+def received():
+    received = []
+    callback = lambda added, removed: received.append((list(added), list(removed)))
+    changes.subscribe("pubkeys", callback)
+    yield received
+    changes.unsubscribe("pubkeys", callback)
+
+def test_ban_reaches_the_other_feed(feeds, received):
+    first, second = feeds
+    first.send("pubkeys", ["a" * 64], [])
+    assert first.flush() == 1
+
+    assert first.poll() == 0
+    assert received == []
+    assert second.poll() == 1
+    assert received == [(["a" * 64], [])]
+    # Nothing new, nothing applied twice
+    assert second.poll() == 0
+    assert len(received) == 1
+
+def test_late_commit_below_last_seen_is_applied(feeds, received):
+    first, second = feeds
+    last_seen = second.last_seen
+    row = {"topic": "pubkeys", "origin": "first", "removed": "[]", "created_at": datetime.utcnow()}
+    db = SessionLocal()
+    try:
+        db.execute(insert(BanChange).values(id=last_seen + 2, added='["b"]', **row))
+        db.commit()
+        assert second.poll() == 1
+        # The skipped id commits after a later one was read
+        db.execute(insert(BanChange).values(id=last_seen + 1, added='["c"]', **row))
+        db.commit()
+    finally:
+        db.close()
+    assert second.poll() == 1
+    assert received == [(["b"], []), (["c"], [])]
+    assert second.poll() == 0
+
+def test_change_after_prune_reaches_the_other_feed(feeds, received, monkeypatch):
+    first, second = feeds
+    first.send("pubkeys", ["d" * 64], [])
+    first.flush()
+    assert second.poll() == 1
+    # Every row has outlived the retention window
+    monkeypatch.setattr(changes, "CHANGES_RETENTION", -60)
+    first.prune()
+
+    first.send("pubkeys", ["e" * 64], [])
+    first.flush()
+    assert second.poll() == 1
+    assert received[-1] == (["e" * 64], [])
@@ -0,0 +1,64 @@
+from models import Base, PublicKey
+from database import engine, SessionLocal
+from datetime import datetime
+import copy
+import hashlib
+import nostr_lists
+
+KEY = hashlib.sha256(b"azzamo-test-signing-key").hexdigest()
+
+def test_chunks_group_and_sort_entries():
+    pubkeys = ["ab" + "1" * 62, "AB" + "0" * 62, "cd" + "2" * 62, "ab" + "1" * 62, "not-a-key"]
+    words = ["spam", "scam", "spam"]
+    result = nostr_lists.chunks(pubkeys, words, 2)
+
+    assert result["azzamo-ban/pubkeys/ab"] == ("p", ["ab" + "0" * 62, "ab" + "1" * 62])
+    assert result["azzamo-ban/pubkeys/cd"] == ("p", ["cd" + "2" * 62])
+    word_chunks = {d_tag: entries for d_tag, (tag_name, entries) in result.items() if tag_name == "word"}
+    assert sorted(word for entries in word_chunks.values() for word in entries) == ["scam", "spam"]
+    for entries in word_chunks.values():
+        assert entries == sorted(entries)
+
+def test_build_event_signs_a_verifiable_set():
+    event = nostr_lists.build_event("azzamo-ban/words/0", "word", ["scam", "spam"], KEY, 1700000000)
+
+    assert event["kind"] == nostr_lists.LIST_KIND
+    assert event["created_at"] == 1700000000
+    assert event["pubkey"] == nostr_lists.public_key_hex(KEY)
+    assert event["tags"] == [["d", "azzamo-ban/words/0"], ["word", "scam"], ["word", "spam"]]
+    assert nostr_lists.verify(event)
+
+    tampered = copy.deepcopy(event)
+    tampered["tags"].append(["word", "hello"])
+    assert not nostr_lists.verify(tampered)
+    tampered = copy.deepcopy(event)
+    tampered["sig"] = "0" * 128
+    assert not nostr_lists.verify(tampered)
+
+def test_workers_serve_the_stored_events():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        db.add(PublicKey(pubkey="ab" + "1" * 62, timestamp=datetime.utcnow()))
+        db.commit()
+        first = nostr_lists.ListPublisher(SessionLocal, KEY, 1, 60)
+        second = nostr_lists.ListPublisher(SessionLocal, KEY, 1, 60)
+
+        first.build()
+        second.build()
+        assert first.signed >= 1 and second.signed == 0
+        assert second.current[2] == first.current[2]
+
+        db.add(PublicKey(pubkey="cd" + "2" * 62, timestamp=datetime.utcnow()))
+        db.commit()
+        before = {event["tags"][0][1]: event for event in first.current[0]}
+        first.build()
+        second.build()
+        assert second.signed == 0
+        assert second.current[2] == first.current[2]
+        after = {event["tags"][0][1]: event for event in second.current[0]}
+        changed = [d_tag for d_tag in after if before.get(d_tag) != after[d_tag]]
+        assert changed == ["azzamo-ban/pubkeys/c"]
+        assert all(nostr_lists.verify(event) for event in after.values())
+    finally:
+        db.close()
@@ -0,0 +1,55 @@
+from models import Base, PublicKey
+from database import engine, SessionLocal
+from schemas import PublicKeyCreate
+import blocklist
+import changes
+import crud
+import fcntl
+import pubkey_set
+import pytest
+import time
+
+@pytest.fixture
+def keys(tmp_path):
+    Base.metadata.create_all(engine)
+    keys = pubkey_set.PubkeySet(SessionLocal, str(tmp_path / "pubkey-set.bin"), 300, 10000)
+    yield keys
+    changes.unsubscribe("pubkeys", keys._on_change)
+    changes.unsubscribe("temp_bans", keys._on_change)
+
+def wait_for_rebuild(keys):
+    deadline = time.monotonic() + 5
+    while keys._rebuilding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not keys._rebuilding
+
+def test_contended_rebuild_backs_off(keys):
+    assert "a" * 64 not in keys
+    keys.max_age = 0
+    with open(keys.path + ".lock", "a") as lock:
+        # Another worker is rebuilding
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert "a" * 64 not in keys
+        wait_for_rebuild(keys)
+        assert keys._retry_at > time.monotonic()
+
+        # No new rebuild thread per lookup until the backoff has passed
+        assert "a" * 64 not in keys
+        assert not keys._rebuilding
+
+def test_ban_after_the_rebuild_is_blocked_through_the_overlay(keys, monkeypatch):
+    monkeypatch.setattr(pubkey_set, "PUBKEY_SET_ENABLED", True)
+    monkeypatch.setattr(pubkey_set, "banned", keys)
+    db = SessionLocal()
+    try:
+        assert crud.check_pubkey_status(db, "b" * 64) == {"status": "not_blocked"}
+        crud.add_blocked_pubkey(db, PublicKeyCreate(pubkey="b" * 64, ban_reason="Spamming"))
+
+        # Not in the file yet, only in the overlay
+        assert not blocklist.contains(keys.mapped, "b" * 64)
+        assert "b" * 64 in keys
+        assert crud.check_pubkey_status(db, "b" * 64) == {"status": "blocked", "temp_ban": False}
+    finally:
+        db.query(PublicKey).delete()
+        db.commit()
+        db.close()
@@ -0,0 +1,58 @@
+from models import Base, TempBan
+from database import engine, SessionLocal
+from schemas import TempBanCreate
+from datetime import datetime, timedelta
+import crud
+import pytest
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    yield db
+    db.query(TempBan).delete()
+    db.commit()
+    db.close()
+
+def add_ban(db, pubkey, expiry, ban_count=1):
+    db.add(TempBan(pubkey=pubkey, expiry_timestamp=expiry, ban_reason="Spamming", ban_count=ban_count))
+    db.commit()
+
+def test_active_ban_is_extended_from_its_expiry(db):
+    # SQLite extends the expiry with millisecond precision
+    expiry = (datetime.utcnow() + timedelta(hours=5)).replace(microsecond=0)
+    add_ban(db, "a" * 64, expiry)
+
+    result = crud.temp_ban_pubkey(db, TempBanCreate(pubkey="a" * 64, duration=24))
+
+    assert result["status"] == "extended"
+    assert result["new_expiry_timestamp"] == expiry + timedelta(hours=24)
+    assert result["ban_reason"] == "Spamming"
+    ban = db.query(TempBan).filter(TempBan.pubkey == "a" * 64).one()
+    assert ban.ban_count == 2
+
+def test_expired_ban_starts_over_from_now(db):
+    add_ban(db, "b" * 64, datetime.utcnow() - timedelta(hours=1))
+
+    before = datetime.utcnow()
+    result = crud.temp_ban_pubkey(db, TempBanCreate(pubkey="b" * 64, duration=2, ban_reason="Scam"))
+
+    assert result["status"] == "banned"
+    assert before + timedelta(hours=2) <= result["expiry_timestamp"] <= datetime.utcnow() + timedelta(hours=2)
+    assert result["ban_reason"] == "Scam"
+    assert db.query(TempBan).filter(TempBan.pubkey == "b" * 64).one().ban_count == 2
+
+def test_duplicate_keys_in_one_batch_extend_each_other(db):
+    result = crud.temp_ban_pubkeys(db, [
+        TempBanCreate(pubkey="c" * 64, duration=1),
+        TempBanCreate(pubkey="c" * 64, duration=2),
+        TempBanCreate(pubkey="d" * 64, duration=1)
+    ])
+
+    assert result["banned"] == 2
+    assert result["extended"] == 1
+    first, second, _ = result["results"]
+    assert abs(second["new_expiry_timestamp"] - first["expiry_timestamp"] - timedelta(hours=2)) < timedelta(milliseconds=1)
+    ban = db.query(TempBan).filter(TempBan.pubkey == "c" * 64).one()
+    assert ban.ban_count == 2
+    assert ban.expiry_timestamp == second["new_expiry_timestamp"]
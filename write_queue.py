@@ -0,0 +1,244 @@
+from starlette.responses import JSONResponse
+from dotenv import load_dotenv
+from collections import OrderedDict, deque
+import asyncio
+import math
+import os
+import time
+import dependencies
+import metrics
+
+# Fair-share scheduling of writes.
+#
+# Every POST, PUT, PATCH and DELETE request with a moderator's API key has to
+# take one of WRITE_CONCURRENCY moderator slots, one by default, before it
+# reaches the endpoint, so moderator writes reach the database one at a time
+# instead of contending for the SQLite writer. Requests without a valid key,
+# such as user reports, take one of PUBLIC_WRITE_CONCURRENCY separate slots,
+# so unauthenticated traffic can never hold up the moderators. The request
+# body is read before a slot is taken, and the slot is given back as soon as
+# the endpoint starts its response, so a slow client holds no slot while it
+# uploads or downloads. All of this is per worker process.
+#
+# Waiting writes are served by deficit round robin over the moderators (or,
+# for public writes, the client IPs) that have writes queued: on its turn a
+# moderator is credited WRITE_QUANTUM seconds, and each write it runs is
+# charged the time it held the slot. A script sending slow bulk writes
+# therefore gets the same share of the writer as a moderator clicking through
+# reports, who is served within a round instead of behind the whole backlog.
+#
+# Moderators also have a token bucket of MODERATOR_WRITE_BURST writes refilled
+# at MODERATOR_WRITE_RATE per second, and at most MODERATOR_WRITE_QUEUE queued
+# writes; at most PUBLIC_WRITE_QUEUE public writes are queued in total. Beyond
+# these limits writes get a 429 with Retry-After. A write that waits longer
+# than WRITE_QUEUE_TIMEOUT seconds for a slot gets a 503. The IP rate limiter
+# runs before all of this, so blocked clients never queue.
+
+load_dotenv()
+
+WRITE_CONCURRENCY = int(os.getenv("WRITE_CONCURRENCY", 1))
+WRITE_QUANTUM = float(os.getenv("WRITE_QUANTUM", 0.05))  # seconds of writer time per turn
+MODERATOR_WRITE_RATE = float(os.getenv("MODERATOR_WRITE_RATE", 10))  # writes per second
+MODERATOR_WRITE_BURST = int(os.getenv("MODERATOR_WRITE_BURST", 50))
+MODERATOR_WRITE_QUEUE = int(os.getenv("MODERATOR_WRITE_QUEUE", 100))  # queued writes per moderator
+PUBLIC_WRITE_CONCURRENCY = int(os.getenv("PUBLIC_WRITE_CONCURRENCY", 1))
+PUBLIC_WRITE_QUEUE = int(os.getenv("PUBLIC_WRITE_QUEUE", 100))  # queued writes without a moderator key, in total
+WRITE_QUEUE_TIMEOUT = float(os.getenv("WRITE_QUEUE_TIMEOUT", 10))  # seconds a write may wait for a slot
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+PUBLIC = "public"
+
+_middlewares = []
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # 0 if a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+class FairScheduler:
+    # Only used from the event loop, so it needs no locking
+    def __init__(self, concurrency: int, quantum: float):
+        self.concurrency = concurrency
+        self.quantum = quantum
+        self.running = 0
+        # identity -> waiting futures, in round-robin order
+        self.queues = OrderedDict()
+        self.deficits = {}
+
+    def queued(self, identity: str | None = None) -> int:
+        # Without an identity, all queued writes
+        if identity is None:
+            return sum(len(waiting) for waiting in self.queues.values())
+        return len(self.queues.get(identity, ()))
+
+    async def acquire(self, identity: str):
+        if self.running < self.concurrency and not self.queues:
+            self.running += 1
+            return
+
+        if identity not in self.queues:
+            # Credit left from an earlier turn does not carry over, debt does
+            self.deficits[identity] = min(self.deficits.get(identity, 0.0), 0.0)
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(identity, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the request went away
+                self.release(identity, 0.0)
+            else:
+                waiting = self.queues.get(identity)
+                if waiting is not None and future in waiting:
+                    waiting.remove(future)
+                    if not waiting:
+                        del self.queues[identity]
+            raise
+
+    def release(self, identity: str, elapsed: float):
+        self.running -= 1
+        if self.queues:
+            self.deficits[identity] = self.deficits.get(identity, 0.0) - elapsed
+        else:
+            # Nobody is waiting, so there is nothing to be fair to
+            self.deficits.pop(identity, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.concurrency and self.queues:
+            identity, waiting = next(iter(self.queues.items()))
+            while waiting and waiting[0].cancelled():
+                waiting.popleft()
+            if not waiting:
+                del self.queues[identity]
+                continue
+            if self.deficits.get(identity, 0.0) <= 0:
+                # Turn used up: credit it for the next one and move on
+                self.deficits[identity] = self.deficits.get(identity, 0.0) + self.quantum
+                self.queues.move_to_end(identity)
+                continue
+            future = waiting.popleft()
+            if not waiting:
+                del self.queues[identity]
+            self.running += 1
+            future.set_result(None)
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": {identity: len(waiting) for identity, waiting in self.queues.items()}
+        }
+
+class WriteSchedulerMiddleware:
+    # A raw ASGI middleware, so reads pass through without an extra task
+    def __init__(self, app, concurrency: int = WRITE_CONCURRENCY, quantum: float = WRITE_QUANTUM, rate: float = MODERATOR_WRITE_RATE, burst: int = MODERATOR_WRITE_BURST,
+                 max_queued: int = MODERATOR_WRITE_QUEUE, public_concurrency: int = PUBLIC_WRITE_CONCURRENCY, max_public_queued: int = PUBLIC_WRITE_QUEUE, timeout: float = WRITE_QUEUE_TIMEOUT):
+        self.app = app
+        self.scheduler = FairScheduler(concurrency, quantum)
+        # Public writes, scheduled fairly per client IP
+        self.public = FairScheduler(public_concurrency, quantum)
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.max_public_queued = max_public_queued
+        self.timeout = timeout
+        self.buckets = {}
+        _middlewares.append(self)
+        metrics.register_write_scheduler(self)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        api_key = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"x-api-key"), None)
+        moderator = dependencies.moderator_for_key(api_key)
+
+        if moderator is not None:
+            scheduler, identity, label = self.scheduler, moderator, moderator
+            if scheduler.queued(moderator) >= self.max_queued:
+                metrics.write_throttled.inc((moderator, "queue"))
+                await self._reject(scope, receive, send, 429, "Too many queued writes", 1.0)
+                return
+            bucket = self.buckets.get(moderator)
+            if bucket is None:
+                bucket = self.buckets[moderator] = TokenBucket(self.rate, self.burst)
+            wait = bucket.take()
+            if wait:
+                metrics.write_throttled.inc((moderator, "quota"))
+                await self._reject(scope, receive, send, 429, "Write quota exceeded", wait)
+                return
+        else:
+            client = scope.get("client")
+            scheduler, identity, label = self.public, client[0] if client else PUBLIC, PUBLIC
+            if scheduler.queued() >= self.max_public_queued:
+                metrics.write_throttled.inc((PUBLIC, "queue"))
+                await self._reject(scope, receive, send, 429, "Too many queued writes", 1.0)
+                return
+
+        # Read the whole body first, so a slow upload holds no slot
+        messages = deque()
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request" or not message.get("more_body", False):
+                break
+        if messages[-1]["type"] == "http.disconnect":
+            return
+
+        async def buffered_receive():
+            return messages.popleft() if messages else await receive()
+
+        try:
+            await asyncio.wait_for(scheduler.acquire(identity), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.write_throttled.inc((label, "timeout"))
+            await self._reject(scope, buffered_receive, send, 503, "Timed out waiting for a write slot", self.timeout)
+            return
+
+        started = time.perf_counter()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                scheduler.release(identity, time.perf_counter() - started)
+
+        async def release_on_response(message):
+            # The endpoint is done with the database once it responds
+            if message["type"] == "http.response.start":
+                release()
+            await send(message)
+
+        try:
+            await self.app(scope, buffered_receive, release_on_response)
+        finally:
+            release()
+
+    async def _reject(self, scope, receive, send, status_code: int, detail: str, retry_after: float):
+        headers = {"Retry-After": str(max(1, math.ceil(min(retry_after, 3600))))}
+        await JSONResponse({"detail": detail}, status_code=status_code, headers=headers)(scope, receive, send)
+
+    def status(self) -> dict:
+        return {
+            **self.scheduler.status(),
+            "public": self.public.status(),
+            "tokens": {moderator: round(min(bucket.burst, bucket.tokens + (time.monotonic() - bucket.updated) * bucket.rate), 1) for moderator, bucket in self.buckets.items()}
+        }
+
+def status() -> dict:
+    # The middleware is created by Starlette on the first request
+    return _middlewares[-1].status() if _middlewares else {"running": 0, "queued": {}, "public": {"running": 0, "queued": {}}, "tokens": {}}